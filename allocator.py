@@ -0,0 +1,166 @@
+import heapq
+
+
+class BuddyAllocator:
+    # Buddy allocator over integer addresses with one free list per prefix
+    # length. Every free block is CIDR aligned, so any block it hands out is
+    # a valid network. Free lists are heaps of block starts so the lowest
+    # block of a size is found in O(log n); a set per prefix length tracks
+    # membership and lets stale heap entries be skipped lazily.
+    # The free address total is kept as blocks come and go, so usage
+    # figures never need a walk over the free lists.
+    def __init__(self, max_prefixlen):
+        self.max_prefixlen = max_prefixlen
+        self._heaps = [[] for _ in range(max_prefixlen + 1)]
+        self._free = [set() for _ in range(max_prefixlen + 1)]
+        self.free_addresses = 0
+
+    def block_size(self, prefixlen):
+        return 1 << (self.max_prefixlen - prefixlen)
+
+    def _add_block(self, start, prefixlen):
+        self._free[prefixlen].add(start)
+        heapq.heappush(self._heaps[prefixlen], start)
+        self.free_addresses += self.block_size(prefixlen)
+
+    def _discard_block(self, start, prefixlen):
+        free = self._free[prefixlen]
+        if start in free:
+            free.remove(start)
+            self.free_addresses -= self.block_size(prefixlen)
+
+    def add_free(self, start, prefixlen):
+        # Return a block to the free lists, merging it with its buddy
+        while prefixlen > 0:
+            buddy = start ^ self.block_size(prefixlen)
+            if buddy not in self._free[prefixlen]:
+                break
+            self._discard_block(buddy, prefixlen)
+            start = min(start, buddy)
+            prefixlen -= 1
+
+        self._add_block(start, prefixlen)
+
+    def add_range(self, first, last):
+        # Split an arbitrary address range into the largest aligned blocks
+        while first <= last:
+            prefixlen = self.max_prefixlen
+            while prefixlen > 0:
+                size = self.block_size(prefixlen - 1)
+                if first % size or first + size - 1 > last:
+                    break
+                prefixlen -= 1
+            self.add_free(first, prefixlen)
+            first += self.block_size(prefixlen)
+
+    def lowest_free(self, prefixlen):
+        # Lowest free block of exactly this prefix length, or None
+        heap = self._heaps[prefixlen]
+        free = self._free[prefixlen]
+        while heap and heap[0] not in free:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def take(self, start, prefixlen, target_prefixlen):
+        # Remove a free block and split it down to the target size, keeping
+        # the lower half each time and freeing the upper buddy
+        self._discard_block(start, prefixlen)
+        while prefixlen < target_prefixlen:
+            prefixlen += 1
+            self.add_free(start + self.block_size(prefixlen), prefixlen)
+        return start
+
+    def find(self, prefixlen, strategy="best"):
+        # Free block to allocate a /prefixlen from, as (start, block prefix
+        # length), or None when nothing fits. "best" picks the smallest free
+        # block that fits, "first" the lowest addressed one.
+        candidates = []
+        for size_prefixlen in range(prefixlen, -1, -1):
+            if not self._free[size_prefixlen]:
+                continue
+            start = self.lowest_free(size_prefixlen)
+            if strategy == "best":
+                return start, size_prefixlen
+            candidates.append((start, size_prefixlen))
+        return min(candidates) if candidates else None
+
+    def allocate(self, prefixlen, strategy="best"):
+        # Start of a newly allocated /prefixlen, or None when full
+        found = self.find(prefixlen, strategy)
+        if found is None:
+            return None
+        return self.take(found[0], found[1], prefixlen)
+
+    def reserve(self, start, prefixlen):
+        # Carve a specific aligned block out of free space, if it is free
+        for size_prefixlen in range(prefixlen, -1, -1):
+            size = self.block_size(size_prefixlen)
+            base = start - start % size
+            if base not in self._free[size_prefixlen]:
+                continue
+
+            self._discard_block(base, size_prefixlen)
+            while size_prefixlen < prefixlen:
+                size_prefixlen += 1
+                half = self.block_size(size_prefixlen)
+                if start >= base + half:
+                    self.add_free(base, size_prefixlen)
+                    base += half
+                else:
+                    self.add_free(base + half, size_prefixlen)
+            return True
+        return False
+
+    def free_blocks(self, prefixlen=None):
+        # Sorted (start, prefixlen) pairs of every free block, or only those
+        # of one prefix length
+        if prefixlen is not None:
+            return [(start, prefixlen) for start in sorted(self._free[prefixlen])]
+        return sorted((start, size_prefixlen)
+                      for size_prefixlen, free in enumerate(self._free)
+                      for start in free)
+
+    def iter_fitting(self, prefixlen):
+        # Every /prefixlen that is free, in address order, carved out of the
+        # free blocks of that size or larger
+        blocks = sorted((start, size_prefixlen)
+                        for size_prefixlen in range(prefixlen + 1)
+                        for start in self._free[size_prefixlen])
+        step = self.block_size(prefixlen)
+        for start, size_prefixlen in blocks:
+            for block_start in range(start, start + self.block_size(size_prefixlen), step):
+                yield block_start
+
+    def histogram(self):
+        # Number of free blocks of every prefix length, indexed by length
+        return [len(free) for free in self._free]
+
+    def largest_free(self):
+        # (start, prefixlen) of the lowest of the largest free blocks
+        for prefixlen, free in enumerate(self._free):
+            if free:
+                return self.lowest_free(prefixlen), prefixlen
+        return None
+
+    def report(self, moves=0):
+        counts = self.histogram()
+        largest = next((p for p, count in enumerate(counts) if count), None)
+        return FragmentationReport(moves, self.free_addresses, sum(counts), largest,
+                                   self.block_size(largest) if largest is not None else 0)
+
+
+class FragmentationReport:
+    def __init__(self, moves, free_addresses, free_blocks, largest_free_prefixlen, largest_free_size):
+        self.moves = moves
+        self.free_addresses = free_addresses
+        self.free_blocks = free_blocks
+        self.largest_free_prefixlen = largest_free_prefixlen
+        # Share of free space outside the largest free block: 0 when all free
+        # space is one block, approaching 1 as it splinters
+        self.fragmentation = 1 - largest_free_size / free_addresses if free_addresses else 0.0
+
+    def __str__(self):
+        largest = f"/{self.largest_free_prefixlen}" if self.largest_free_prefixlen is not None else "none"
+        return (f"{self.moves} subnets moved, {self.free_addresses} free addresses in "
+                f"{self.free_blocks} blocks, largest free block {largest}, "
+                f"fragmentation {self.fragmentation:.1%}")
@@ -0,0 +1,70 @@
+from subnet_engine import network_from_int
+
+
+class PlanStats:
+    # Usage of one plan at one version. Every figure is read from the
+    # plan's free-space index, which the plan keeps in step with each
+    # change, so taking stats costs O(prefix lengths) however many subnets
+    # there are; only a plan with no index yet pays for one walk over its
+    # gaps.
+    def __init__(self, plan):
+        summary = plan.summary
+        if summary is None:
+            raise ValueError("No summary address set.")
+
+        free_space = plan.free_space()
+        report = free_space.report()
+        self.summary = summary
+        self.version = plan.version
+        self.subnets = len(plan.subnets)
+        self.total_addresses = summary.num_addresses
+        self.free_addresses = report.free_addresses
+        self.used_addresses = self.total_addresses - self.free_addresses
+        self.utilization = self.used_addresses / self.total_addresses
+        self.free_blocks = report.free_blocks
+        self.fragmentation = report.fragmentation
+
+        # Free blocks by prefix length, largest blocks first
+        self.histogram = {prefixlen: count for prefixlen, count in enumerate(free_space.histogram()) if count}
+
+        largest = free_space.largest_free()
+        self.largest_free = network_from_int(summary.version, *largest) if largest is not None else None
+
+    def capacity(self, prefixlen):
+        # How many /prefixlen blocks could still be allocated
+        if not self.summary.prefixlen <= prefixlen <= self.summary.max_prefixlen:
+            return 0
+        return sum(count << (prefixlen - size_prefixlen)
+                   for size_prefixlen, count in self.histogram.items()
+                   if size_prefixlen <= prefixlen)
+
+    def as_dict(self, prefixlens=()):
+        # `prefixlens` adds the capacity left for blocks of those sizes
+        figures = {
+            'summary': str(self.summary),
+            'subnets': self.subnets,
+            'total_addresses': self.total_addresses,
+            'used_addresses': self.used_addresses,
+            'free_addresses': self.free_addresses,
+            'utilization': self.utilization,
+            'free_blocks': self.free_blocks,
+            'largest_free': str(self.largest_free) if self.largest_free is not None else None,
+            'fragmentation': self.fragmentation,
+            'histogram': {f"/{prefixlen}": count for prefixlen, count in self.histogram.items()},
+        }
+        if prefixlens:
+            figures['capacity'] = {f"/{prefixlen}": self.capacity(prefixlen) for prefixlen in prefixlens}
+        return figures
+
+    def histogram_text(self):
+        return " ".join(f"/{prefixlen}: {count}" for prefixlen, count in self.histogram.items()) or "none"
+
+    def __str__(self):
+        largest = str(self.largest_free) if self.largest_free is not None else "none"
+        return (f"{self.summary}: {self.utilization:.1%} used by {self.subnets} subnets, "
+                f"{self.free_addresses} free addresses in {self.free_blocks} blocks, "
+                f"largest free block {largest}, fragmentation {self.fragmentation:.1%}")
+
+
+def plan_stats(plan):
+    return PlanStats(plan)
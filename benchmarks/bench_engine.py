@@ -0,0 +1,244 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subnet_engine import SubnetPlan, Subnet, import_csv, network_from_int, write_csv
+from layout import Layout
+from snapshot import load_snapshot, open_snapshot, save_snapshot
+from plan_diff import diff_plans
+from analytics import plan_stats
+
+# Block size of every synthetic subnet, as host bits
+BLOCK_HOST_BITS = {4: 4, 6: 64}
+
+# Slots in the summary per subnet: dense plans are packed into the low
+# quarter, fragmented ones scattered over all of it. Either way there is room
+# for the add and allocate benchmarks.
+SLOTS_PER_SUBNET = {"dense": 4, "fragmented": 8}
+
+# Window of the canvas the renderer would draw, in pixels
+CANVAS_HEIGHT = 800
+
+
+def synthetic_plan(count, version, layout, seed=0):
+    # Summary and (label, start, prefix length) rows of a synthetic plan
+    rng = random.Random(seed)
+    max_prefixlen = 32 if version == 4 else 128
+    host_bits = BLOCK_HOST_BITS[version]
+    slots = count * SLOTS_PER_SUBNET[layout]
+    slot_bits = (slots - 1).bit_length()
+
+    base = (10 << 24) if version == 4 else (0x20010db8 << 96)
+    base = base >> (host_bits + slot_bits) << (host_bits + slot_bits)
+    summary = network_from_int(version, base, max_prefixlen - host_bits - slot_bits)
+    if layout == "dense":
+        used = list(range(count))
+    else:
+        used = rng.sample(range(1 << slot_bits), count)
+
+    rows = [(f"subnet-{i}", base + (slot << host_bits), max_prefixlen - host_bits) for i, slot in enumerate(used)]
+    return summary, rows
+
+
+def free_starts(summary, rows, count, seed=0):
+    # Starts of `count` blocks that are free in the plan, in random order
+    rng = random.Random(seed)
+    prefixlen = rows[0][2]
+    host_bits = summary.max_prefixlen - prefixlen
+    base = int(summary.network_address)
+    used = {start for _, start, _ in rows}
+    slots = 1 << (prefixlen - summary.prefixlen)
+    free = []
+    while len(free) < count:
+        start = base + (rng.randrange(slots) << host_bits)
+        if start not in used:
+            used.add(start)
+            free.append(start)
+    return free
+
+
+def load_plan(summary, rows):
+    plan = SubnetPlan(summary)
+    plan.load(Subnet(label, summary.version, start, prefixlen) for label, start, prefixlen in rows)
+    return plan
+
+
+def timed(func, trace_memory=False):
+    # (result, seconds, peak traced bytes or None)
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_case(count, version, layout, ops, trace_memory=False):
+    # Every benchmark for one synthetic plan. Operations that touch one
+    # subnet at a time run `ops` times and are reported per operation.
+    summary, rows = synthetic_plan(count, version, layout)
+    ops = min(ops, count)
+    prefixlen = rows[0][2]
+    results = {}
+
+    def record(name, func, per=1):
+        result, seconds, peak = timed(func, trace_memory)
+        results[name] = {'seconds': seconds}
+        if per > 1:
+            results[name]['per_op_seconds'] = seconds / per
+        if peak is not None:
+            results[name]['peak_bytes'] = peak
+        return result
+
+    plan = record('load', lambda: load_plan(summary, rows))
+
+    targets = free_starts(summary, rows, ops, seed=1)
+    queries = [network_from_int(version, start, prefixlen) for start in targets]
+    record('overlap_check', lambda: [plan.find_overlap(network) for network in queries], per=ops)
+    record('add_subnet', lambda: [plan.add_subnet(f"added-{i}", network) for i, network in enumerate(queries)], per=ops)
+    # The free-space index is built on first use; time it on its own so
+    # allocate shows the steady-state cost
+    record('free_space', lambda: plan.free_space())
+    record('allocate', lambda: [plan.allocate(f"auto-{i}", prefixlen) for i in range(ops)], per=ops)
+    record('undo', lambda: [plan.undo() for _ in range(ops)], per=ops)
+    # Stats read the free-space index the edits above kept current
+    record('stats', lambda: [plan_stats(plan) for _ in range(ops)], per=ops)
+
+    layout_result = record('layout', lambda: Layout(plan, CANVAS_HEIGHT))
+    # Rows the renderer would draw for a window at the middle of the plan
+    middle = layout_result.height / 2
+    record('visible_rows', lambda: [len(layout_result.visible_rows(middle + i, middle + i + CANVAS_HEIGHT))
+                                    for i in range(ops)], per=ops)
+
+    buffer = io.StringIO()
+    record('csv_export', lambda: write_csv(plan, buffer))
+    text = buffer.getvalue()
+    results['csv_export']['bytes'] = len(text)
+    record('csv_import', lambda: import_csv(io.StringIO(text)))
+
+    # Snapshots are mapped from a file, so they go through a temporary one
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "plan.snap")
+        record('snapshot_export', lambda: save_snapshot([plan], path))
+        results['snapshot_export']['bytes'] = os.path.getsize(path)
+        record('snapshot_open', lambda: open_snapshot(path).close())
+        record('snapshot_load', lambda: load_snapshot(path))
+
+    # The edited plan against a fresh copy differs by the added subnets
+    fresh = load_plan(summary, rows)
+    diff = record('diff', lambda: diff_plans(plan, fresh))
+    results['diff']['entries'] = len(diff)
+
+    report = record('optimize', lambda: fresh.optimize())
+    results['optimize']['moves'] = report.moves
+
+    return {
+        'count': count,
+        'version': version,
+        'layout': layout,
+        'summary': str(summary),
+        'ops': ops,
+        'results': results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(cases, baseline, threshold):
+    # Lines describing every timing slower than the baseline by more than
+    # `threshold` (0.2 = 20%)
+    previous = {(case['count'], case['version'], case['layout']): case['results'] for case in baseline['cases']}
+    regressions = []
+    for case in cases:
+        old = previous.get((case['count'], case['version'], case['layout']))
+        if old is None:
+            continue
+        for name, result in case['results'].items():
+            if name not in old or not old[name]['seconds']:
+                continue
+            ratio = result['seconds'] / old[name]['seconds']
+            if ratio > 1 + threshold:
+                regressions.append(f"{case['count']} IPv{case['version']} {case['layout']} {name}: "
+                                   f"{old[name]['seconds']:.4f}s -> {result['seconds']:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the engine and layout hot paths on synthetic plans. Runs headless: "
+                    "the layout is the computation behind the canvas, without Tk.")
+    parser.add_argument("-n", "--sizes", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="Plan sizes in subnets")
+    parser.add_argument("--versions", type=int, nargs="+", choices=[4, 6], default=[4, 6], help="IP versions")
+    parser.add_argument("--layouts", nargs="+", choices=sorted(SLOTS_PER_SUBNET), default=["dense", "fragmented"],
+                        help="Dense plans are packed, fragmented ones scattered over the summary")
+    parser.add_argument("--ops", type=int, default=10000, help="Operations per single-subnet benchmark")
+    parser.add_argument("--memory", action="store_true",
+                        help="Trace peak memory of every step; slows the timings down")
+    parser.add_argument("-o", "--output", help="Write results as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--baseline", help="Results JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown allowed against the baseline")
+    args = parser.parse_args(argv)
+
+    cases = []
+    for count in args.sizes:
+        for version in args.versions:
+            for layout in args.layouts:
+                case = run_case(count, version, layout, args.ops, args.memory)
+                cases.append(case)
+                if not args.json:
+                    print(f"{count} IPv{version} {layout} ({case['summary']}):", file=sys.stderr)
+                    for name, result in case['results'].items():
+                        per_op = f", {result['per_op_seconds'] * 1e6:.1f}us/op" if 'per_op_seconds' in result else ""
+                        peak = f", {result['peak_bytes'] / 2 ** 20:.1f} MiB peak" if 'peak_bytes' in result else ""
+                        print(f"  {name:15} {result['seconds']:8.3f}s{per_op}{peak}", file=sys.stderr)
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'memory_traced': args.memory,
+        'cases': cases,
+    }
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(cases, json.load(baseline), args.threshold)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import argparse
+import ipaddress
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subnet_engine import SubnetPlan, Subnet
+
+
+def synthetic_rows(count, seed=0):
+    # (label, network int, prefix length) for `count` /28s inside 10.0.0.0/8,
+    # shuffled so both layouts have to sort
+    rng = random.Random(seed)
+    starts = rng.sample(range(1 << 20), count)
+    return [(f"subnet-{i}", (10 << 24) + (start << 4), 28) for i, start in enumerate(starts)]
+
+
+def build_dicts(rows):
+    # The original layout: one dict and IPv4Network per subnet
+    subnets = [{
+        'label': label,
+        'network': ipaddress.IPv4Network((start, prefixlen)),
+        'rect_id': None,
+        'label_id': None
+    } for label, start, prefixlen in rows]
+    subnets.sort(key=lambda x: x['network'].network_address)
+    return subnets
+
+
+def build_store(rows):
+    plan = SubnetPlan(ipaddress.ip_network("10.0.0.0/8"))
+    plan.load(Subnet(label, 4, start, prefixlen) for label, start, prefixlen in rows)
+    return plan
+
+
+def measure(builder, rows):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = builder(rows)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {'seconds': elapsed, 'retained_bytes': current, 'peak_bytes': peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare memory of the dict layout and the compact subnet store.")
+    parser.add_argument("-n", "--count", type=int, default=200000, help="Number of subnets")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    rows = synthetic_rows(args.count)
+    results = {
+        'count': args.count,
+        'dict_layout': measure(build_dicts, rows),
+        'compact_store': measure(build_store, rows),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    for name in ('dict_layout', 'compact_store'):
+        result = results[name]
+        print(f"{name:14} {result['retained_bytes'] / args.count:8.1f} bytes/subnet retained, "
+              f"{result['peak_bytes'] / 2 ** 20:8.1f} MiB peak, {result['seconds']:.2f}s to build and sort")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import argparse
+import json
+import sys
+
+from subnet_engine import (SubnetPlan, Document, ImportResult, import_csv, load_document, nesting_errors, parse_network,
+                           save_document, write_document, write_rejections)
+from analytics import plan_stats
+from instrumentation import instruments
+from plan_diff import DIFF_KINDS, diff_plans, match_plan, merge_diff, write_diff
+from snapshot import SNAPSHOT_EXTENSION, is_snapshot, load_snapshot, open_snapshot, save_snapshot
+
+
+def select_plans(plans, summary_text):
+    # Plans a command works on: all of them, or with --summary the plan with
+    # that summary. A plan whose subnets all fit the new summary is
+    # retargeted to it, otherwise the summary starts a new, empty plan.
+    if not summary_text:
+        return plans
+    summary = parse_network(summary_text)
+    plan = next((plan for plan in plans if plan.summary == summary), None)
+    if plan is None:
+        plan = next((plan for plan in plans if plan.fits(summary)), None)
+        if plan is not None:
+            plan.summary = summary
+    if plan is None:
+        plan = SubnetPlan(summary)
+        plans.append(plan)
+    return [plan]
+
+
+def open_document(args):
+    # A summary nested in another plan without a subnet behind it is
+    # refused: that plan's free space would hand its block out again
+    plans = load_snapshot(args.file) if is_snapshot(args.file) else load_document(args.file)
+    selected = select_plans(plans, args.summary)
+    errors = nesting_errors(plans)
+    if errors:
+        raise ValueError(errors[0])
+    return plans, selected
+
+
+def open_nested_document(args):
+    # open_document() for commands that change plans: the plans join a
+    # Document first, so a summary nested under a subnet follows it when
+    # the subnet moves, and changes that would orphan one are refused
+    plans, selected = open_document(args)
+    return plans, selected, Document(plan for plan in plans if plan.summary is not None)
+
+
+def output_document(plans, args):
+    # An output ending in .snap is written as a binary snapshot
+    if args.output and args.output.endswith(SNAPSHOT_EXTENSION):
+        save_snapshot(plans, args.output)
+    elif args.output:
+        save_document(plans, args.output)
+    else:
+        write_document(plans, sys.stdout)
+
+
+def diff_documents(selected, filepath):
+    # Diff every selected plan against the plan for its summary in another
+    # file; a snapshot is compared straight from the mapped file. Each diff
+    # is made just before it is yielded, so merging one plan, which can
+    # move the plans nested in it, never leaves a later diff stale.
+    def diff_all(others):
+        for plan in selected:
+            other = match_plan(others, plan.summary)
+            if other is None:
+                raise ValueError(f"{filepath} has no plan for {plan.summary}")
+            yield diff_plans(plan, other)
+
+    if is_snapshot(filepath):
+        with open_snapshot(filepath) as snapshot:
+            yield from diff_all(snapshot.plans)
+    else:
+        yield from diff_all(load_document(filepath))
+
+
+def print_counts(diff):
+    counts = diff.counts()
+    print(f"{diff.plan.summary}: " + ", ".join(f"{counts[kind]} {kind}" for kind in DIFF_KINDS), file=sys.stderr)
+
+
+def cmd_validate(args):
+    # Report every bad row instead of stopping at the first one. Snapshots
+    # are written from loaded plans, so they have no rows to reject.
+    if is_snapshot(args.file):
+        result = ImportResult(load_snapshot(args.file), [], 0)
+    else:
+        with open(args.file, "r", newline="") as csvfile:
+            result = import_csv(csvfile)
+    plans = select_plans(result.plans, args.summary)
+
+    for line, label, subnet_text, reason in result.rejected:
+        print(f"Line {line} ({label}, {subnet_text}): {reason}", file=sys.stderr)
+    if args.rejections:
+        with open(args.rejections, "w", newline="") as report:
+            write_rejections(result.rejected, report)
+
+    errors = [error for plan in plans for error in plan.validate()] + nesting_errors(result.plans)
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors or result.rejected:
+        return 1
+    for plan in plans:
+        print(f"{len(plan.subnets)} subnets OK in {plan.summary}")
+    return 0
+
+
+def cmd_optimize(args):
+    plans, selected, document = open_nested_document(args)
+    reports = [(plan.summary, plan.optimize(minimize_moves=args.minimize_moves)) for plan in selected]
+    output_document(plans, args)
+    for summary, report in reports:
+        print(f"{summary}: {report}", file=sys.stderr)
+    return 0
+
+
+def cmd_gaps(args):
+    plans, selected = open_document(args)
+    for plan in selected:
+        for first, last in plan.gaps():
+            print(f"Available ({plan.address(first)} - {plan.address(last)}) {last - first + 1} addresses")
+    return 0
+
+
+def cmd_allocate(args):
+    plans, selected, document = open_nested_document(args)
+    for i in range(args.count):
+        label = f"{args.label}{i + 1}" if args.count > 1 else args.label
+        # First summary, in document order, with a free block of that size
+        plan = next((plan for plan in selected if plan.find_free(args.prefix, args.strategy) is not None), None)
+        if plan is None:
+            raise ValueError(f"No free /{args.prefix} block in any summary address range.")
+        subnet = plan.allocate(label, args.prefix, args.strategy)
+        print(f"{subnet.label},{subnet.network}", file=sys.stderr)
+    output_document(plans, args)
+    return 0
+
+
+def cmd_free(args):
+    plans, selected = open_document(args)
+    for plan in selected:
+        for i, network in enumerate(plan.free_networks(args.prefix)):
+            if args.limit and i >= args.limit:
+                break
+            print(network)
+    return 0
+
+
+def cmd_tree(args):
+    # Summaries indented under the summary they are nested in
+    plans, selected = open_document(args)
+    document = Document(plans)
+    for root in selected:
+        # Without --summary, nested plans are printed under their parents
+        if not args.summary and document.parent(root) is not None:
+            continue
+        base = document.depth(root)
+        for plan in document.subtree(root):
+            indent = "  " * (document.depth(plan) - base)
+            print(f"{indent}{plan.summary} {len(plan.subnets)} subnets")
+    return 0
+
+
+def cmd_stats(args):
+    plans, selected = open_document(args)
+    stats = [plan_stats(plan) for plan in selected if plan.summary is not None]
+    prefixlens = args.prefix or []
+    if args.json:
+        print(json.dumps([entry.as_dict(prefixlens) for entry in stats], indent=2))
+        return 0
+    for entry in stats:
+        print(entry)
+        print(f"  free blocks by size: {entry.histogram_text()}")
+        for prefixlen in prefixlens:
+            print(f"  room for {entry.capacity(prefixlen)} more /{prefixlen} blocks")
+    return 0
+
+
+def cmd_export(args):
+    # A whole snapshot is streamed row by row straight from the mapped file
+    if not args.summary and is_snapshot(args.file):
+        with open_snapshot(args.file) as snapshot:
+            output_document(snapshot.plans, args)
+        return 0
+
+    plans, selected = open_document(args)
+    output_document(plans, args)
+    return 0
+
+
+def cmd_diff(args):
+    # Exits 1 when the plans differ, like diff(1)
+    plans, selected = open_document(args)
+    diffs = list(diff_documents(selected, args.other))
+    report = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for diff in diffs:
+            print_counts(diff)
+            write_diff(diff, report)
+    finally:
+        if args.output:
+            report.close()
+    return 1 if any(diffs) else 0
+
+
+def cmd_merge(args):
+    plans, selected, document = open_nested_document(args)
+    for diff in diff_documents(selected, args.other):
+        print_counts(diff)
+        change, skipped = merge_diff(diff.plan, diff, args.prefer)
+        if skipped:
+            print(f"{diff.plan.summary}: kept {len(skipped)} differences involving conflicts", file=sys.stderr)
+    output_document(plans, args)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Validate, optimize and export subnet plans without the GUI.")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Record timings and counters of the command and write them to FILE as JSON")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    commands = [
+        ("validate", cmd_validate, "Check a plan for overlaps and subnets outside the summary"),
+        ("optimize", cmd_optimize, "Repack subnets into aligned blocks and write the optimized plan"),
+        ("gaps", cmd_gaps, "List the free address ranges in a plan"),
+        ("allocate", cmd_allocate, "Allocate free blocks of a prefix length and write the plan"),
+        ("free", cmd_free, "List the free blocks of a prefix length"),
+        ("stats", cmd_stats, "Show utilization, free blocks by size and fragmentation of each summary"),
+        ("tree", cmd_tree, "Show how the summaries in a plan nest inside each other"),
+        ("export", cmd_export, "Rewrite a plan as a normalized CSV, or as a snapshot with -o FILE.snap"),
+        ("diff", cmd_diff, "Report added, removed, resized, relabelled and conflicting subnets against another plan"),
+        ("merge", cmd_merge, "Merge another plan's changes into a plan and write the result"),
+    ]
+    for name, func, help_text in commands:
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("file", help="Plan CSV or .snap snapshot as written by Export")
+        subparser.add_argument("-s", "--summary", help="Work on this summary only, retargeting the plan whose subnets fit it")
+        if name in ("diff", "merge"):
+            subparser.add_argument("other", help="Plan CSV or snapshot to compare with, matched by summary")
+        if name == "diff":
+            subparser.add_argument("-o", "--output", help="Report CSV (default: stdout)")
+        if name == "merge":
+            subparser.add_argument("--prefer", choices=["current", "other"], default="current",
+                                   help="Side whose subnets win where the plans conflict")
+        if name == "stats":
+            subparser.add_argument("--json", action="store_true", help="Print the figures as JSON")
+            subparser.add_argument("-p", "--prefix", type=int, action="append",
+                                   help="Also show how many blocks of this prefix length still fit (repeatable)")
+        if name == "validate":
+            subparser.add_argument("-r", "--rejections", help="Write rejected rows to this CSV")
+        if name == "optimize":
+            subparser.add_argument("-m", "--minimize-moves", action="store_true",
+                                   help="Keep subnets that already fit the packed layout in place")
+        if name in ("allocate", "free"):
+            subparser.add_argument("-p", "--prefix", type=int, required=True, help="Prefix length to allocate or list")
+        if name == "allocate":
+            subparser.add_argument("-n", "--count", type=int, default=1, help="Number of blocks to allocate")
+            subparser.add_argument("-l", "--label", default="auto", help="Label, numbered when allocating more than one")
+            subparser.add_argument("--strategy", choices=["first", "best"], default="first",
+                                   help="Lowest free block, or the smallest free block that fits")
+        if name == "free":
+            subparser.add_argument("--limit", type=int, default=0, help="Stop after this many blocks")
+        if name in ("optimize", "export", "allocate", "merge"):
+            subparser.add_argument("-o", "--output", help="Output CSV, or snapshot if it ends in .snap (default: CSV on stdout)")
+        subparser.set_defaults(func=func)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        instruments.enabled = True
+    try:
+        return args.func(args)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        # Written even when the command fails, since that run is often the
+        # one worth a report
+        if args.profile:
+            with open(args.profile, "w") as f:
+                instruments.dump(f)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
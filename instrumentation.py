@@ -0,0 +1,136 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Most recent timings kept as the event log
+EVENT_LOG_SIZE = 500
+
+# Setting this environment variable turns instrumentation on at startup
+PROFILE_ENV = "SUBNET_PROFILE"
+
+
+class Timing:
+    __slots__ = ('count', 'total', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+
+class NullTimer:
+    # Shared by every timer() call while instrumentation is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    __slots__ = ('instruments', 'name', 'started')
+
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Instruments:
+    # Named timers and counters around the slow paths: parsing, the
+    # overlap pass, sorting, optimization, layout and drawing. Switched off,
+    # timer() returns a shared no-op and callers guard count() behind
+    # `enabled`, so each call site costs one attribute check. Timers are
+    # placed per operation, never per row.
+    # Workers record from their own threads, so updates take a lock.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+            self.events = deque(maxlen=EVENT_LOG_SIZE)
+            self.started = time.time()
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def timed(self, name):
+        # Decorator form of timer()
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Timer(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def record(self, name, seconds):
+        with self._lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = Timing()
+            timing.add(seconds)
+            self.events.append((time.time(), threading.current_thread().name, name, seconds))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        # Everything recorded so far as JSON-ready data
+        with self._lock:
+            return {
+                'started': self.started,
+                'timings': {
+                    name: {'count': timing.count, 'total_seconds': timing.total,
+                           'max_seconds': timing.max, 'last_seconds': timing.last}
+                    for name, timing in sorted(self.timings.items())
+                },
+                'counters': dict(sorted(self.counters.items())),
+                'events': [{'time': at, 'thread': thread, 'name': name, 'seconds': seconds}
+                           for at, thread, name, seconds in self.events],
+            }
+
+    def dump(self, f):
+        json.dump(self.snapshot(), f, indent=2)
+
+    def summary_lines(self, limit=None):
+        # Timers by total time, then counters, as short lines for display
+        with self._lock:
+            timings = sorted(self.timings.items(), key=lambda item: item[1].total, reverse=True)
+            counters = sorted(self.counters.items())
+        lines = [f"{name}: {timing.count}x, {timing.total * 1000:.1f} ms total, {timing.last * 1000:.1f} ms last"
+                 for name, timing in timings[:limit]]
+        lines.extend(f"{name}: {value}" for name, value in counters)
+        return lines
+
+
+instruments = Instruments(enabled=bool(os.environ.get(PROFILE_ENV)))
@@ -0,0 +1,172 @@
+import bisect
+from array import array
+
+from instrumentation import instruments
+
+SUMMARY_BAR_HEIGHT = 30
+ROW_SPACING = 5
+MIN_SUBNET_HEIGHT = 20
+
+# Summaries with more addresses than this are drawn on a log scale when the
+# scale is "auto", since a /64 inside a /32 would otherwise be 2**-32 of it
+LOG_SCALE_THRESHOLD = 1 << 32
+
+# Extra height a block spanning the whole address space gets on a log scale
+LOG_SCALE_HEIGHT = 100
+
+SCALES = ("auto", "linear", "log")
+
+# Rows laid out between progress callbacks
+LAYOUT_CHUNK_SIZE = 10000
+
+
+def resolve_scale(summary_network, scale="auto"):
+    if scale == "auto":
+        return "log" if summary_network.num_addresses > LOG_SCALE_THRESHOLD else "linear"
+    return scale
+
+
+class Layout:
+    # Vertical position of every subnet and gap row, computed without Tk so
+    # the renderer can look up the rows inside the scroll window by bisect.
+    # Address counts stay Python ints throughout, so IPv6 sizes are exact
+    # until they are turned into pixels.
+    # Each row keeps a normalized height (its share of the summary on a
+    # linear scale, pixels on a log scale), so a new canvas height only
+    # needs rescale() rather than another walk over the plan.
+    # `progress(rows)` is called every LAYOUT_CHUNK_SIZE rows, which lets a
+    # layout built on a worker thread be cancelled; `plan` and `version`
+    # identify what it was built from, so a stale layout can be told apart.
+    @instruments.timed("layout.build")
+    def __init__(self, plan, canvas_height, scale="auto", progress=None):
+        self.plan = plan
+        self.version = plan.version
+        self.scale_setting = scale
+        self.segments = []
+        # First address of every row, for mapping addresses back to rows
+        self.firsts = []
+        self.weights = array('d')
+
+        summary_network = plan.summary
+        self.summary = summary_network
+        self.scale = resolve_scale(summary_network, scale)
+        max_prefixlen = summary_network.max_prefixlen
+        total_addresses = summary_network.num_addresses
+
+        for segment in plan.segments():
+            if progress is not None and len(self.segments) % LAYOUT_CHUNK_SIZE == 0:
+                progress(len(self.segments))
+            if segment[0] == 'gap':
+                gap_addresses = segment[2] - segment[1] + 1
+                if self.scale == "log":
+                    weight = LOG_SCALE_HEIGHT * gap_addresses.bit_length() / max_prefixlen
+                else:
+                    weight = gap_addresses / total_addresses
+                first = segment[1]
+            else:
+                subnet = segment[1]
+                if self.scale == "log":
+                    weight = MIN_SUBNET_HEIGHT + LOG_SCALE_HEIGHT * (max_prefixlen - subnet.prefixlen) / max_prefixlen
+                else:
+                    weight = subnet.num_addresses / total_addresses
+                first = subnet.start
+
+            self.segments.append(segment)
+            self.firsts.append(first)
+            self.weights.append(weight)
+
+        self.canvas_height = None
+        self.rescale(canvas_height)
+
+    @instruments.timed("layout.rescale")
+    def rescale(self, canvas_height):
+        # Pixel tops and heights for a canvas height. Log-scale rows do not
+        # depend on the canvas, so they are only placed once.
+        if self.canvas_height is not None and self.scale == "log":
+            self.canvas_height = canvas_height
+            return
+
+        self.canvas_height = canvas_height
+        start_y = SUMMARY_BAR_HEIGHT + 10
+        self.available = max(canvas_height - start_y - 20, 1)
+        tops = array('d')
+        heights = array('d')
+
+        linear = self.scale != "log"
+        available = self.available
+        for segment, weight in zip(self.segments, self.weights):
+            height = weight
+            if linear:
+                height = available * weight
+                if segment[0] != 'gap' and height < MIN_SUBNET_HEIGHT:
+                    height = MIN_SUBNET_HEIGHT
+            tops.append(start_y)
+            heights.append(height)
+            start_y += height + ROW_SPACING
+
+        self.tops = tops
+        self.heights = heights
+        self.height = start_y
+
+    def __len__(self):
+        return len(self.segments)
+
+    def row_key(self, i):
+        # Stable identity of a row across layouts, used to recycle its items
+        segment = self.segments[i]
+        if segment[0] == 'gap':
+            return ('gap', segment[1])
+        return ('subnet', id(segment[1]))
+
+    def visible_rows(self, top, bottom):
+        first = max(bisect.bisect_right(self.tops, top) - 1, 0)
+        last = bisect.bisect_left(self.tops, bottom)
+        return range(first, last)
+
+    def row_at(self, y):
+        if not self.segments:
+            return None
+        return min(max(bisect.bisect_right(self.tops, y) - 1, 0), len(self.segments) - 1)
+
+    def address_at(self, y):
+        # Address under a y coordinate, interpolated inside the row there
+        i = self.row_at(y)
+        if i is None or y < self.tops[0]:
+            return int(self.summary.network_address)
+
+        segment = self.segments[i]
+        if segment[0] == 'gap':
+            first, last = segment[1], segment[2]
+        else:
+            first, last = segment[1].start, segment[1].end
+
+        height = self.heights[i]
+        fraction = min(max((y - self.tops[i]) / height, 0), 1) if height else 0
+        # Fixed-point fraction keeps the multiplication in exact integers
+        return first + (last - first + 1) * int(fraction * (1 << 20)) // (1 << 20)
+
+    def y_for_address(self, address):
+        # Inverse of address_at: y of an address inside the row holding it,
+        # or the bottom of the last row for the address after the summary
+        if not self.segments:
+            return SUMMARY_BAR_HEIGHT + 10
+        i = max(bisect.bisect_right(self.firsts, address) - 1, 0)
+        segment = self.segments[i]
+        if segment[0] == 'gap':
+            first, last = segment[1], segment[2]
+        else:
+            first, last = segment[1].start, segment[1].end
+
+        if address > last:
+            return self.tops[i] + self.heights[i]
+        return self.tops[i] + self.heights[i] * (max(address - first, 0) / (last - first + 1))
+
+    def prefixlen_for_height(self, height):
+        # Prefix length a row of this height starting at `top` would have
+        max_prefixlen = self.summary.max_prefixlen
+        if self.scale == "log":
+            host_bits = round((height - MIN_SUBNET_HEIGHT) * max_prefixlen / LOG_SCALE_HEIGHT)
+        else:
+            num_addresses = int(self.summary.num_addresses * height // self.available)
+            host_bits = (num_addresses - 1).bit_length() if num_addresses > 1 else 0
+        return min(max(max_prefixlen - host_bits, self.summary.prefixlen), max_prefixlen)
@@ -1,8 +1,47 @@
 import tkinter as tk
 import tkinter.messagebox as messagebox
 import tkinter.filedialog as filedialog
-import ipaddress
-import csv
+import tkinter.font as tkfont
+import tkinter.ttk as ttk
+import os
+
+from subnet_engine import (SubnetPlan, Document, ImportResult, parse_network, import_csv, write_document,
+                           write_rejections, host_range, network_from_int)
+from snapshot import SNAPSHOT_EXTENSION, is_snapshot, open_snapshot, load_snapshot, write_snapshot
+from layout import Layout, SUMMARY_BAR_HEIGHT, MIN_SUBNET_HEIGHT, SCALES
+from tasks import Task
+from instrumentation import instruments
+from analytics import plan_stats
+from plan_diff import DIFF_KINDS, diff_plans, match_plan, merge_diff, write_diff
+
+# Extra canvas height drawn above and below the scroll window
+RENDER_OVERSCAN = 200
+
+# How often the UI checks on background work, in milliseconds
+TASK_POLL_INTERVAL = 50
+
+# Plans with more subnets than this are laid out on a worker thread
+LAYOUT_BACKGROUND_THRESHOLD = 20000
+
+# Drag motion is applied at most once per frame, in milliseconds
+DRAG_FRAME_INTERVAL = 16
+
+# Quiet time after the last <Configure> event before the canvas is
+# repainted, in milliseconds
+RESIZE_DEBOUNCE_INTERVAL = 100
+
+# Differences against a compared plan are marked in a strip down the right
+# edge of the rows, at most DIFF_MARKER_LIMIT of them in the scroll window
+DIFF_COLORS = {"added": "cyan", "removed": "red", "resized": "orange", "relabelled": "yellow",
+               "conflicting": "magenta"}
+DIFF_MARKER_WIDTH = 24
+DIFF_MARKER_LIMIT = 1000
+
+# While profiling, the overlay of timings is refreshed this often, in
+# milliseconds, and lists this many of the slowest timers
+PROFILE_REFRESH_INTERVAL = 500
+PROFILE_OVERLAY_LINES = 12
+
 
 class SubnetVisualizer:
     def __init__(self, master):
@@ -21,6 +60,20 @@ class SubnetVisualizer:
         self.summary_range_label = tk.Label(self.summary_frame, text="")
         self.summary_range_label.pack(side=tk.LEFT, padx=5)
 
+        # Every summary in the document, e.g. an IPv4 and an IPv6 block
+        self.summary_select = ttk.Combobox(self.summary_frame, state="readonly", width=30)
+        self.summary_select.pack(side=tk.LEFT, padx=5)
+        self.summary_select.bind("<<ComboboxSelected>>", self.on_summary_selected)
+
+        # Back up to the summary the current one is nested in
+        self.zoom_out_button = tk.Button(self.summary_frame, text="Zoom Out", command=self.zoom_out)
+        self.zoom_out_button.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(self.summary_frame, text="Scale:").pack(side=tk.LEFT)
+        self.scale = tk.StringVar(value=SCALES[0])
+        self.scale_menu = tk.OptionMenu(self.summary_frame, self.scale, *SCALES, command=self.on_scale_change)
+        self.scale_menu.pack(side=tk.LEFT, padx=5)
+
         # Add Subnet
         self.add_subnet_frame = tk.Frame(master)
         self.add_subnet_frame.pack()
@@ -36,19 +89,65 @@ class SubnetVisualizer:
         self.add_subnet_button = tk.Button(self.add_subnet_frame, text="Add Subnet", command=self.add_subnet)
         self.add_subnet_button.pack(side=tk.LEFT, padx=5)
 
+        # Takes a prefix length ("/24" or "24") in the Subnet field
+        self.auto_allocate_button = tk.Button(self.add_subnet_frame, text="Auto-allocate", command=self.auto_allocate_subnet)
+        self.auto_allocate_button.pack(side=tk.LEFT, padx=5)
+
         # Import and Export Buttons
         button_frame = tk.Frame(master)
         button_frame.pack(pady=5)
 
-        self.import_button = tk.Button(button_frame, text="Import from CSV", command=self.import_from_csv)
+        self.import_button = tk.Button(button_frame, text="Import", command=self.import_from_csv)
         self.import_button.pack(side=tk.LEFT, padx=5)
 
-        self.export_button = tk.Button(button_frame, text="Export to CSV", command=self.export_to_csv)
+        self.export_button = tk.Button(button_frame, text="Export", command=self.export_to_csv)
         self.export_button.pack(side=tk.LEFT, padx=5)
 
+        # Diff the plan against another export of it
+        self.compare_button = tk.Button(button_frame, text="Compare", command=self.compare_plan)
+        self.compare_button.pack(side=tk.LEFT, padx=5)
+
         self.optimize_button = tk.Button(button_frame, text="Optimize Subnets", command=self.optimize_subnets)
         self.optimize_button.pack(side=tk.LEFT, padx=5)
 
+        self.minimize_moves = tk.BooleanVar(value=False)
+        self.minimize_moves_check = tk.Checkbutton(button_frame, text="Minimize moves", variable=self.minimize_moves)
+        self.minimize_moves_check.pack(side=tk.LEFT, padx=5)
+
+        # Timers and counters for performance reports, also toggled by F12
+        self.profiling = tk.BooleanVar(value=instruments.enabled)
+        self.profile_check = tk.Checkbutton(button_frame, text="Profile", variable=self.profiling,
+                                            command=self.toggle_profiling)
+        self.profile_check.pack(side=tk.LEFT, padx=5)
+        self.save_profile_button = tk.Button(button_frame, text="Save Profile", command=self.save_profile)
+        self.profile_font = tkfont.nametofont("TkFixedFont").copy()
+        self.profile_font.configure(size=8)
+        self.profile_item = None
+        self.profile_job = None
+
+        self.undo_button = tk.Button(button_frame, text="Undo", command=self.undo_change)
+        self.undo_button.pack(side=tk.LEFT, padx=5)
+
+        self.redo_button = tk.Button(button_frame, text="Redo", command=self.redo_change)
+        self.redo_button.pack(side=tk.LEFT, padx=5)
+
+        # Shown only while an import, export or optimization is running
+        self.task_progress = ttk.Progressbar(button_frame, length=150, mode="determinate")
+        self.cancel_button = tk.Button(button_frame, text="Cancel", command=self.cancel_task)
+        self.task = None
+        self.layout_task = None
+
+        # Shown only while a diff is on the canvas
+        self.diff_frame = tk.Frame(master)
+        self.diff_label = tk.Label(self.diff_frame, text="")
+        self.diff_label.pack(side=tk.LEFT, padx=5)
+        tk.Button(self.diff_frame, text="Merge", command=self.merge_differences).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.diff_frame, text="Export Report", command=self.export_diff_report).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.diff_frame, text="Clear", command=self.clear_diff).pack(side=tk.LEFT, padx=5)
+        self.diff = None
+        self.diff_items = []
+        self.diff_shown = 0
+
         # --- Canvas and Scrollbars ---
         self.canvas_frame = tk.Frame(master)
         self.canvas_frame.pack(pady=20, fill=tk.BOTH, expand=True)
@@ -59,14 +158,28 @@ class SubnetVisualizer:
         self.y_scrollbar = tk.Scrollbar(self.canvas_frame, orient="vertical", command=self.canvas.yview)
         self.y_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-        self.canvas.configure(yscrollcommand=self.y_scrollbar.set)
+        self.canvas.configure(yscrollcommand=self.on_canvas_yview)
 
-        # Subnet List
-        self.subnets = []
+        # Usage of the summary on show, kept current as the plan changes
+        self.stats_label = tk.Label(master, text="", anchor=tk.W, justify=tk.LEFT)
+        self.stats_label.pack(fill=tk.X, padx=10, pady=5)
+        self.stats_task = None
+
+        # Subnet List, kept in address order by the plan's allocation index.
+        # The document nests one plan per summary; self.plan is the one shown
+        # and joins the document once it has a summary.
+        self.plan = SubnetPlan()
+        self.plan.listeners.append(self.on_plan_change)
+        self.document = Document()
 
         # Drag and resize variables
         self.selected_subnet = None
-        self.drag_data = {"x": 0, "y": 0, "item": None, "resize": None}
+        # "origin" is the row's rectangle at the press, "pointer" the latest
+        # motion y, "target" the network the drop would snap to, if valid
+        self.drag_data = {"y": 0, "item": None, "label_item": None, "resize": None,
+                          "origin": None, "pointer": None, "frame": None, "target": None}
+        self.snap_item = None
+        self.snap_state = None
 
         # Bind events
         self.canvas.bind("<Configure>", self.on_canvas_resize)
@@ -74,11 +187,31 @@ class SubnetVisualizer:
         self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
         self.canvas.bind("<Double-Button-1>", self.on_canvas_double_click)
+        self.canvas.bind("<Button-3>", self.on_canvas_drill_down)
         self.canvas.bind("<MouseWheel>", self.on_canvas_scroll)
-
-        # --- Virtual Canvas Frame (for drawing) ---
-        self.visual_frame = tk.Frame(self.canvas)
-        self.canvas.create_window((0, 0), window=self.visual_frame, anchor="nw")
+        master.bind("<Control-z>", lambda event: self.undo_change())
+        master.bind("<Control-y>", lambda event: self.redo_change())
+        master.bind("<Control-Z>", lambda event: self.redo_change())
+        master.bind("<F12>", self.toggle_profiling)
+
+        # Only rows inside the scroll window are drawn; their canvas items
+        # come from a pool and are recycled as rows scroll in and out
+        self.layout = None
+        self.summary_items = None
+        self.row_slots = {}
+        self.free_slots = []
+        # Canvas item id -> slot, so an item resolves to its row's record
+        self.slot_by_item = {}
+        self.resize_job = None
+
+        # Profiling switched on from the environment shows its overlay and
+        # Save Profile button from the start
+        if instruments.enabled:
+            self.toggle_profiling()
+
+    @property
+    def subnets(self):
+        return self.plan.subnets
 
     def update_summary_range(self, event=None):
         summary_address_str = self.summary_entry.get()
@@ -87,296 +220,894 @@ class SubnetVisualizer:
             return
 
         try:
-            summary_network = ipaddress.ip_network(summary_address_str, strict=False)
-            first_ip = summary_network[1]
-            last_ip = summary_network[-2]
+            first_ip, last_ip = host_range(parse_network(summary_address_str))
             self.summary_range_label.config(text=f"({first_ip} - {last_ip})")
         except ValueError:
             self.summary_range_label.config(text="(Invalid Summary Address)")
 
+    def select_summary(self):
+        # Show the plan for the summary in the entry: an existing plan with
+        # that summary, the plan drilled into the matching subnet of the
+        # summary around it, the current plan retargeted if it is empty or
+        # its subnets fit, or a new plan. A summary nested in another one
+        # with no subnet behind it is refused, since the plan around it
+        # would hand its block out again.
+        summary_network = parse_network(self.summary_entry.get())
+        plan = self.document.get(summary_network)
+        if plan is None:
+            subnet = self.document.nested_subnet(summary_network)
+            if subnet is not None:
+                plan = self.document.drill_down(subnet)
+            elif self.plan.summary is None or self.plan.fits(summary_network):
+                plan = self.plan
+                self.document.retarget(plan, summary_network)
+            else:
+                plan = SubnetPlan(summary_network)
+                self.document.add_plan(plan)
+
+        self.show_plan(plan)
+        return summary_network
+
+    def show_plan(self, plan):
+        if plan is not self.plan:
+            self.plan.listeners.remove(self.on_plan_change)
+            self.plan = plan
+            self.plan.listeners.append(self.on_plan_change)
+            self.layout = None
+            self.clear_diff()
+            # Slots are keyed by row, so the old plan's rows all go back
+            for slot in self.row_slots.values():
+                self.release_slot(slot)
+            self.row_slots.clear()
+
+        if plan.summary is not None and self.summary_entry.get() != str(plan.summary):
+            self.summary_entry.delete(0, tk.END)
+            self.summary_entry.insert(0, str(plan.summary))
+            self.update_summary_range()
+        self.update_summary_select()
+        self.update_stats()
+
+    def update_stats(self):
+        # Stats are read from the plan's free-space index in O(prefix
+        # lengths). Only a large plan that has no index yet, such as one
+        # just imported, has it built on a worker thread first.
+        plan = self.plan
+        if plan.summary is None:
+            self.stats_label.config(text="")
+            return
+
+        if not plan.has_free_space and len(plan.subnets) > LAYOUT_BACKGROUND_THRESHOLD:
+            task = self.stats_task
+            if task is None or task.args != (plan, plan.version):
+                if task is not None:
+                    task.cancel()
+                self.stats_task = Task(self.run_free_space, plan, plan.version).start()
+                self.master.after(TASK_POLL_INTERVAL, self.poll_stats, self.stats_task)
+            self.stats_label.config(text=f"{plan.summary}: computing usage...")
+            return
+
+        stats = plan_stats(plan)
+        self.stats_label.config(text=f"{stats}\nFree blocks by size: {stats.histogram_text()}")
+
+    def run_free_space(self, progress, plan, version):
+        return plan.build_free_space(progress)
+
+    def poll_stats(self, task):
+        if task is not self.stats_task:
+            return
+
+        for kind, payload in task.poll():
+            if kind == 'progress':
+                continue
+
+            self.stats_task = None
+            plan, version = task.args
+            # An index built for an older version is dropped and rebuilt
+            if kind == 'done':
+                plan.adopt_free_space(payload, version)
+            elif kind == 'error':
+                self.stats_label.config(text=f"{plan.summary}: usage unavailable: {payload}")
+                return
+            if plan is self.plan:
+                self.update_stats()
+            return
+
+        self.master.after(TASK_POLL_INTERVAL, self.poll_stats, task)
+
+    def update_summary_select(self):
+        # Nested summaries are indented under the summary holding them
+        summaries = ["  " * self.document.depth(plan) + str(plan.summary) for plan in self.document]
+        self.summary_select.config(values=summaries)
+        if self.plan.summary is not None:
+            self.summary_select.set(str(self.plan.summary))
+
+    def on_summary_selected(self, event=None):
+        plan = self.document.get(parse_network(self.summary_select.get()))
+        if plan is not None:
+            self.show_plan(plan)
+            self.visualize_subnets(plan.summary)
+
+    def drill_down(self, subnet):
+        # Render only the blocks inside a subnet, making it a summary
+        self.show_plan(self.document.drill_down(subnet))
+        self.visualize_subnets(self.plan.summary)
+
+    def zoom_out(self):
+        parent = self.document.parent(self.plan) if self.plan.summary is not None else None
+        if parent is None:
+            self.master.bell()
+            return
+        self.show_plan(parent)
+        self.visualize_subnets(parent.summary)
+
+    def on_scale_change(self, scale=None):
+        if self.plan.summary is not None:
+            self.visualize_subnets(self.plan.summary)
+
     def add_subnet(self):
-        summary_address_str = self.summary_entry.get()
         subnet_label = self.subnet_label_entry.get()
         subnet_str = self.subnet_entry.get()
 
         try:
-            summary_network = ipaddress.ip_network(summary_address_str, strict=False)
-            subnet = ipaddress.ip_network(subnet_str, strict=False)
+            self.select_summary()
+            subnet = parse_network(subnet_str)
         except ValueError as e:
             messagebox.showerror("Error", f"Invalid IP address or subnet: {e}")
             return
 
-        if not summary_network.supernet_of(subnet):
-            messagebox.showerror("Error", "Subnet is not within the summary address range.")
+        # A subnet inside a nested summary goes to that summary's plan
+        plan = self.document.plan_for(subnet) or self.plan
+        try:
+            plan.add_subnet(subnet_label, subnet)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
 
-        for existing_subnet in self.subnets:
-            if existing_subnet['network'].overlaps(subnet):
-                messagebox.showerror("Error", f"Subnet overlaps with existing subnet: {existing_subnet['label']}")
-                return
+        if plan is not self.plan:
+            self.show_plan(plan)
+            self.visualize_subnets(plan.summary)
 
-        self.subnets.append({
-            'label': subnet_label,
-            'network': subnet,
-            'rect_id': None,
-            'label_id': None
-        })
+        self.subnet_label_entry.delete(0, tk.END)
+        self.subnet_entry.delete(0, tk.END)
+
+    def auto_allocate_subnet(self):
+        subnet_label = self.subnet_label_entry.get()
+        prefix_str = self.subnet_entry.get().strip().lstrip("/")
+
+        try:
+            self.select_summary()
+            prefixlen = int(prefix_str)
+        except ValueError as e:
+            messagebox.showerror("Error", f"Enter a summary address and a prefix length such as /24: {e}")
+            return
+
+        try:
+            self.plan.allocate(subnet_label, prefixlen)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
 
-        self.subnets.sort(key=lambda x: x['network'].network_address)
         self.subnet_label_entry.delete(0, tk.END)
         self.subnet_entry.delete(0, tk.END)
-        self.visualize_subnets(summary_network)
+
+    def start_task(self, work, args, maximum, on_done):
+        # Run heavy work on a worker thread while the UI stays live; the
+        # mainloop polls it for progress and on_done(kind, payload) runs on
+        # the UI thread once it finishes, fails or is cancelled
+        self.task = Task(work, *args)
+        for button in (self.import_button, self.export_button, self.compare_button, self.optimize_button):
+            button.config(state=tk.DISABLED)
+        self.task_progress.config(maximum=max(maximum, 1), value=0)
+        self.task_progress.pack(side=tk.LEFT, padx=5)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        self.task.start()
+        self.master.after(TASK_POLL_INTERVAL, self.poll_task, self.task, on_done)
+
+    def poll_task(self, task, on_done):
+        for kind, payload in task.poll():
+            if kind == 'progress':
+                self.task_progress.config(value=payload)
+                continue
+
+            self.task = None
+            self.task_progress.pack_forget()
+            self.cancel_button.pack_forget()
+            for button in (self.import_button, self.export_button, self.compare_button, self.optimize_button):
+                button.config(state=tk.NORMAL)
+            on_done(kind, payload)
+            return
+
+        self.master.after(TASK_POLL_INTERVAL, self.poll_task, task, on_done)
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
 
     def import_from_csv(self):
+        if self.task is not None:
+            return
+
         filepath = filedialog.askopenfilename(
             defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+            filetypes=[("CSV files", "*.csv"), ("Plan snapshots", "*" + SNAPSHOT_EXTENSION), ("All files", "*.*")]
         )
         if not filepath:
             return
 
+        # Progress is measured in subnets loaded from a snapshot, and in
+        # characters read from a CSV
         try:
-            with open(filepath, "r") as csvfile:
-                reader = csv.reader(csvfile)
-                
-                # First row should be summary address
-                summary_row = next(reader)
-                if summary_row[0] == "Summary":
-                    self.summary_entry.delete(0, tk.END)
-                    self.summary_entry.insert(0, summary_row[1])
-                    self.update_summary_range()
-                
-                # Skip header row
-                next(reader)
-                
-                # Clear existing subnets
-                self.subnets = []
-
-                for row in reader:
-                    subnet = ipaddress.ip_network(row[1], strict=False)
-                    self.subnets.append({
-                        'label': row[0],
-                        'network': subnet,
-                        'rect_id': None,
-                        'label_id': None
-                    })
-
-            self.subnets.sort(key=lambda x: x['network'].network_address)
-            summary_network = ipaddress.ip_network(self.summary_entry.get(), strict=False)
-            self.visualize_subnets(summary_network)
+            snapshot = is_snapshot(filepath)
+            if snapshot:
+                with open_snapshot(filepath) as mapped:
+                    maximum = len(mapped)
+            else:
+                maximum = os.path.getsize(filepath)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Import Error", f"An error occurred: {e}")
+            return
+        self.start_task(self.run_import, (filepath, snapshot), maximum, self.finish_import)
+
+    def run_import(self, progress, filepath, snapshot):
+        # Runs off the UI thread, so it must not touch any widget
+        if snapshot:
+            plans = load_snapshot(filepath, progress)
+            return ImportResult(plans, [], sum(len(plan.subnets) for plan in plans)), None
+
+        with open(filepath, "r", newline="") as csvfile:
+            result = import_csv(csvfile, progress=progress)
+
+        rejection_path = None
+        if result.rejected:
+            rejection_path = os.path.splitext(filepath)[0] + ".rejected.csv"
+            with open(rejection_path, "w", newline="") as report:
+                write_rejections(result.rejected, report)
+
+        return result, rejection_path
+
+    def finish_import(self, kind, payload):
+        if kind == 'cancelled':
+            return
+        if kind == 'error':
+            messagebox.showerror("Import Error", f"An error occurred: {payload}")
+            return
+
+        result, rejection_path = payload
+        try:
+            plans = result.plans
+            if not plans:
+                plans = [SubnetPlan(parse_network(self.summary_entry.get()))]
+            for plan in plans:
+                if plan.summary is None:
+                    # No summary in the file: use the entry if everything
+                    # fits in it, else the smallest block covering the plan
+                    entry_summary = parse_network(self.summary_entry.get()) if self.summary_entry.get() else None
+                    if entry_summary is not None and plan.fits(entry_summary):
+                        plan.summary = entry_summary
+                    else:
+                        plan.summary = plan.covering_network() or entry_summary
+
+            # Summaries nested in the file nest in the document too
+            self.document = Document(plans)
+            self.show_plan(self.document.plans[0])
+            self.visualize_subnets(self.plan.summary)
 
         except Exception as e:
             messagebox.showerror("Import Error", f"An error occurred: {e}")
+            return
 
-    def visualize_subnets(self, summary_network):
-        # Clear the visual_frame instead of the canvas
-        for widget in self.visual_frame.winfo_children():
-            widget.destroy()
-
-        self.canvas.delete("all")
+        if rejection_path:
+            messagebox.showwarning(
+                "Import Warning",
+                f"Imported {sum(len(plan.subnets) for plan in plans)} of {result.rows} rows. "
+                f"{len(result.rejected)} rejected rows were written to {rejection_path}"
+            )
 
+    @instruments.timed("render.visualize")
+    def visualize_subnets(self, summary_network):
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
 
-        summary_bar_height = 30
-
         # Summary address range text
-        first_ip = summary_network[1]
-        last_ip = summary_network[-2]
+        first_ip, last_ip = host_range(summary_network)
         summary_range_text = f"{summary_network} ({first_ip} - {last_ip})"
 
-        self.canvas.create_rectangle(0, 0, canvas_width, summary_bar_height, fill="blue", outline="black")
-        self.canvas.create_text(10, summary_bar_height / 2, text=summary_range_text, anchor=tk.W, fill="white")
-
-        total_addresses = summary_network.num_addresses
-        start_y = summary_bar_height + 10
-        current_address = summary_network.network_address
+        if self.summary_items is None:
+            if instruments.enabled:
+                instruments.count("canvas.items_created", 2)
+            self.summary_items = (
+                self.canvas.create_rectangle(0, 0, canvas_width, SUMMARY_BAR_HEIGHT, fill="blue", outline="black"),
+                self.canvas.create_text(10, SUMMARY_BAR_HEIGHT / 2, text=summary_range_text, anchor=tk.W, fill="white"),
+            )
+        else:
+            self.canvas.coords(self.summary_items[0], 0, 0, canvas_width, SUMMARY_BAR_HEIGHT)
+            self.canvas.itemconfig(self.summary_items[1], text=summary_range_text)
+
+        # A newer layout always replaces the one still being computed
+        if self.layout_task is not None:
+            self.layout_task.cancel()
+            self.layout_task = None
+
+        # The cached layout stays valid until the plan or the scale changes;
+        # a new canvas size only rescales its rows
+        layout = self.layout
+        if (layout is not None and layout.plan is self.plan and layout.version == self.plan.version
+                and layout.scale_setting == self.scale.get()):
+            if layout.canvas_height != canvas_height:
+                layout.rescale(canvas_height)
+            self.show_layout(layout)
+            return
 
-        for subnet in self.subnets:
-            # Draw space between subnets if any
-            if current_address < subnet['network'].network_address:
-                gap_addresses = int(subnet['network'].network_address) - int(current_address)
-                gap_ratio = gap_addresses / total_addresses
-                gap_height = max((canvas_height - start_y - 20) * gap_ratio, 0)
+        if len(self.plan.subnets) <= LAYOUT_BACKGROUND_THRESHOLD:
+            self.show_layout(Layout(self.plan, canvas_height, self.scale.get()))
+            return
 
-                # Calculate first and last IP of the gap
-                first_gap_ip = current_address
-                last_gap_ip = subnet['network'].network_address - 1
-                gap_range_text = f"Available ({first_gap_ip} - {last_gap_ip})"
+        # Large plans are laid out on a worker thread; the rows already on
+        # the canvas stay up until the new layout is ready
+        self.layout_task = Task(self.run_layout, self.plan, canvas_height, self.scale.get()).start()
+        self.master.after(TASK_POLL_INTERVAL, self.poll_layout, self.layout_task)
 
-                gap_id = self.canvas.create_rectangle(10, start_y, canvas_width - 10, start_y + gap_height, fill="gray", outline="black")
-                self.canvas.create_text(20, start_y + gap_height / 2, text=gap_range_text, anchor=tk.W, fill="black")
-                self.canvas.itemconfig(gap_id, tags=("gap",))
+    def run_layout(self, progress, plan, canvas_height, scale):
+        return Layout(plan, canvas_height, scale, progress)
 
-                start_y += gap_height + 5
+    def poll_layout(self, task):
+        if task is not self.layout_task:
+            return
 
-            # Draw subnet
-            subnet_ratio = subnet['network'].num_addresses / total_addresses
-            subnet_height = max((canvas_height - start_y - 20) * subnet_ratio, 20)
+        for kind, payload in task.poll():
+            if kind == 'progress':
+                continue
+
+            self.layout_task = None
+            if kind == 'error':
+                messagebox.showerror("Error", f"An error occurred while drawing the plan: {payload}")
+            elif kind == 'done':
+                # The plan may have changed while the layout was computed
+                if task.args[0] is self.plan and payload.version == self.plan.version:
+                    self.show_layout(payload)
+                elif self.plan.summary is not None:
+                    self.visualize_subnets(self.plan.summary)
+            return
 
-            rect_id = self.canvas.create_rectangle(10, start_y, canvas_width - 10, start_y + subnet_height, fill="green", outline="black")
-            label_text = f"{subnet['label']} ({subnet['network']})"
-            label_id = self.canvas.create_text(20, start_y + subnet_height / 2, text=label_text, anchor=tk.W, fill="white")
+        self.master.after(TASK_POLL_INTERVAL, self.poll_layout, task)
 
-            subnet['rect_id'] = rect_id
-            subnet['label_id'] = label_id
-            self.canvas.itemconfig(rect_id, tags=("subnet", subnet['label']))
+    def show_layout(self, layout):
+        self.layout = layout
 
-            start_y += subnet_height + 5
-            current_address = subnet['network'].broadcast_address + 1
+        # Scroll region covers the whole plan even though only part is drawn
+        self.canvas.config(scrollregion=(0, 0, self.canvas.winfo_width(), layout.height))
+        self.render_visible()
 
-        # Draw remaining space at the end
-        if current_address < summary_network.broadcast_address:
-            remaining_addresses = int(summary_network.broadcast_address) - int(current_address) + 1
-            remaining_ratio = remaining_addresses / total_addresses
-            remaining_height = max((canvas_height - start_y - 10) * remaining_ratio, 0)
+    @instruments.timed("render.visible")
+    def render_visible(self):
+        if self.layout is None:
+            return
 
-            # Calculate first and last IP of the remaining space
-            first_remaining_ip = current_address
-            last_remaining_ip = summary_network.broadcast_address
-            remaining_range_text = f"Available ({first_remaining_ip} - {last_remaining_ip})"
+        canvas_width = self.canvas.winfo_width()
+        top = self.canvas.canvasy(0) - RENDER_OVERSCAN
+        bottom = self.canvas.canvasy(self.canvas.winfo_height()) + RENDER_OVERSCAN
+
+        visible = {}
+        for i in self.layout.visible_rows(top, bottom):
+            visible[self.layout.row_key(i)] = i
+
+        # Return items of rows that scrolled out or no longer exist to the
+        # pool, except the dragged row's: the drag moves those until the drop
+        dragged = ('subnet', id(self.selected_subnet)) if self.drag_data["item"] is not None else None
+        for key in [key for key in self.row_slots if key not in visible and key != dragged]:
+            self.release_slot(self.row_slots.pop(key))
+
+        for key, i in visible.items():
+            slot = self.row_slots.get(key)
+            if slot is None:
+                slot = self.acquire_slot()
+                self.row_slots[key] = slot
+            self.draw_row(slot, i, canvas_width)
+
+        self.render_diff(top, bottom, canvas_width)
+
+    def render_diff(self, top, bottom, canvas_width):
+        # Markers for the differences in the scroll window, drawn from a
+        # pool of rectangles like the rows
+        entries = []
+        if self.diff is not None and self.layout is not None and self.layout.segments:
+            first, last = self.layout.address_at(top), self.layout.address_at(bottom)
+            entries = self.diff.within(first, last)[:DIFF_MARKER_LIMIT]
+
+        while len(self.diff_items) < len(entries):
+            if instruments.enabled:
+                instruments.count("canvas.items_created")
+            self.diff_items.append(self.canvas.create_rectangle(0, 0, 0, 0, outline="black", tags=("diff",)))
+        for item, entry in zip(self.diff_items, entries):
+            y1 = self.layout.y_for_address(entry.first)
+            y2 = max(self.layout.y_for_address(entry.last + 1), y1 + 3)
+            self.canvas.coords(item, canvas_width - 10 - DIFF_MARKER_WIDTH, y1, canvas_width - 10, y2)
+            self.canvas.itemconfig(item, fill=DIFF_COLORS[entry.kind], state="normal")
+        for item in self.diff_items[len(entries):self.diff_shown]:
+            self.canvas.itemconfig(item, state="hidden")
+        self.diff_shown = len(entries)
+        if entries:
+            # Row items taken from the pool later must not cover the markers
+            self.canvas.tag_raise("diff")
+
+    def acquire_slot(self):
+        if self.free_slots:
+            return self.free_slots.pop()
+
+        if instruments.enabled:
+            instruments.count("canvas.items_created", 2)
+        slot = {
+            'rect_id': self.canvas.create_rectangle(0, 0, 0, 0, outline="black", state="hidden"),
+            'label_id': self.canvas.create_text(0, 0, anchor=tk.W, state="hidden"),
+            'state': None,
+            'subnet': None
+        }
+        self.slot_by_item[slot['rect_id']] = slot
+        self.slot_by_item[slot['label_id']] = slot
+        return slot
+
+    def release_slot(self, slot):
+        self.canvas.itemconfig(slot['rect_id'], state="hidden")
+        self.canvas.itemconfig(slot['label_id'], state="hidden")
+
+        slot['state'] = None
+        slot['subnet'] = None
+        self.free_slots.append(slot)
+
+    def draw_row(self, slot, i, canvas_width):
+        segment = self.layout.segments[i]
+        start_y = self.layout.tops[i]
+        height = self.layout.heights[i]
+
+        if segment[0] == 'gap':
+            # Calculate first and last IP of the gap
+            subnet = None
+            text = f"Available ({self.plan.address(segment[1])} - {self.plan.address(segment[2])})"
+            fill, text_fill, tags = "gray", "black", ("gap",)
+        else:
+            subnet = segment[1]
+            text = f"{subnet.label} ({subnet.network})"
+            # Subnets with blocks drilled into them are a darker shade
+            fill = "darkgreen" if self.document.nested_plan(subnet) is not None else "green"
+            text_fill, tags = "white", ("subnet",)
+
+        # Only touch the Tk items when what the row shows has changed
+        coords = (10, start_y, canvas_width - 10, start_y + height)
+        state = (coords, text, fill, tags)
+        if slot['state'] != state:
+            self.canvas.coords(slot['rect_id'], *coords)
+            self.canvas.itemconfig(slot['rect_id'], fill=fill, tags=tags, state="normal")
+            self.canvas.coords(slot['label_id'], 20, start_y + height / 2)
+            self.canvas.itemconfig(slot['label_id'], text=text, fill=text_fill, state="normal")
+            slot['state'] = state
+            if instruments.enabled:
+                instruments.count("canvas.rows_redrawn")
+
+        slot['subnet'] = subnet
+
+    def subnet_at(self, y):
+        # Subnet under the pointer: the item Tk tracks as "current" maps
+        # straight to its slot; otherwise bisect the layout's row tops
+        items = self.canvas.find_withtag("current")
+        slot = self.slot_by_item.get(items[0]) if items else None
+        if slot is not None:
+            return slot['subnet']
+
+        if self.layout is None:
+            return None
+        i = self.layout.row_at(y)
+        if i is None or not self.layout.tops[i] <= y <= self.layout.tops[i] + self.layout.heights[i]:
+            return None
+        segment = self.layout.segments[i]
+        return segment[1] if segment[0] == 'subnet' else None
+
+    def subnet_slot(self, subnet):
+        # Canvas items currently showing a subnet, or None if it is off-screen
+        return self.row_slots.get(('subnet', id(subnet)))
+
+    def invalidate_row(self, subnet):
+        # Force a redraw of a row whose items were moved outside the renderer
+        slot = self.subnet_slot(subnet)
+        if slot is not None:
+            slot['state'] = None
+
+    def on_plan_change(self, change):
+        # Rows the change touched are redrawn; the rest of the visible rows
+        # are only updated if the new layout shifted them. A diff only
+        # describes the plan as it was compared.
+        if self.diff is not None:
+            self.clear_diff()
+        if change is not None:
+            for subnet in change.subnets():
+                self.invalidate_row(subnet)
+        if self.plan.summary is not None:
+            self.visualize_subnets(self.plan.summary)
+        self.update_stats()
+
+    def undo_change(self):
+        try:
+            if self.plan.undo() is None:
+                self.master.bell()
+        except ValueError as e:
+            messagebox.showerror("Undo Error", str(e))
 
-            remaining_id = self.canvas.create_rectangle(10, start_y, canvas_width - 10, start_y + remaining_height, fill="gray", outline="black")
-            self.canvas.create_text(20, start_y + remaining_height / 2, text=remaining_range_text, anchor=tk.W, fill="black")
-            self.canvas.itemconfig(remaining_id, tags=("gap",))
+    def redo_change(self):
+        try:
+            if self.plan.redo() is None:
+                self.master.bell()
+        except ValueError as e:
+            messagebox.showerror("Redo Error", str(e))
 
-        # Update scroll region after drawing
-        self.canvas.update_idletasks()
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+    def on_canvas_yview(self, first, last):
+        self.y_scrollbar.set(first, last)
+        self.render_visible()
 
     def export_to_csv(self):
-        if not self.subnets:
+        if self.task is not None:
+            return
+        if not any(plan.subnets for plan in self.document):
             messagebox.showwarning("Warning", "No subnets to export.")
             return
 
         try:
-            with open("subnets.csv", "w", newline="") as csvfile:
-                writer = csv.writer(csvfile)
-                # Add summary address as first row
-                writer.writerow(["Summary", str(self.summary_entry.get())])
-                # Header for subnet data
-                writer.writerow(["Label", "Subnet", "Network Address", "Broadcast Address", "Number of Hosts"])
-
-                for subnet in self.subnets:
-                    writer.writerow([
-                        subnet['label'],
-                        str(subnet['network']),
-                        str(subnet['network'].network_address),
-                        str(subnet['network'].broadcast_address),
-                        subnet['network'].num_addresses - 2
-                    ])
-
-            messagebox.showinfo("Export Successful", "Subnet data exported to subnets.csv")
-
-        except Exception as e:
+            if self.summary_entry.get():
+                self.select_summary()
+        except ValueError as e:
             messagebox.showerror("Export Error", f"An error occurred during export: {e}")
+            return
 
-    def on_canvas_press(self, event):
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
+        # Every summary goes into the one file, each as its own section. The
+        # worker writes a partial file that only replaces the export once
+        # the UI thread has checked no plan changed in the meantime.
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            initialfile="subnets.csv",
+            filetypes=[("CSV files", "*.csv"), ("Plan snapshots", "*" + SNAPSHOT_EXTENSION), ("All files", "*.*")]
+        )
+        if not filepath:
+            return
 
-        canvas_item = self.canvas.find_closest(x, y)
-        tags = self.canvas.gettags(canvas_item)
+        plans = [plan for plan in self.document if plan.subnets or plan is self.plan]
+        versions = [plan.version for plan in plans]
+        partial = filepath + ".partial"
+        self.start_task(
+            self.run_export, (plans, partial, filepath.endswith(SNAPSHOT_EXTENSION)),
+            sum(len(plan.subnets) for plan in plans),
+            lambda kind, payload: self.finish_export(kind, payload, plans, versions, filepath, partial)
+        )
 
-        if "subnet" in tags:
-            label = tags[1]
-            self.selected_subnet = next((s for s in self.subnets if s['label'] == label), None)
-            if self.selected_subnet:
-                self.drag_data["item"] = self.selected_subnet['rect_id']
-                self.drag_data["x"] = x
-                self.drag_data["y"] = y
-                rect_coords = self.canvas.coords(self.selected_subnet['rect_id'])
+    def run_export(self, progress, plans, partial, snapshot):
+        if snapshot:
+            with open(partial, "wb") as snapshotfile:
+                write_snapshot(plans, snapshotfile, progress)
+            return
+        with open(partial, "w", newline="") as csvfile:
+            write_document(plans, csvfile, progress=progress)
 
-                if abs(y - rect_coords[3]) < 5:
-                    self.drag_data["resize"] = "bottom"
-                else:
-                    self.drag_data["resize"] = None
+    def finish_export(self, kind, payload, plans, versions, filepath, partial):
+        if kind == 'done' and [plan.version for plan in plans] == versions:
+            os.replace(partial, filepath)
+            messagebox.showinfo("Export Successful", f"Subnet data exported to {filepath}")
+            return
 
-    def on_canvas_drag(self, event):
-        if self.selected_subnet and self.drag_data["item"]:
-            x = self.canvas.canvasx(event.x)
-            y = self.canvas.canvasy(event.y)
+        if os.path.exists(partial):
+            os.remove(partial)
+        if kind == 'error':
+            messagebox.showerror("Export Error", f"An error occurred during export: {payload}")
+        elif kind == 'done':
+            messagebox.showerror("Export Error", "The plan changed during export. Export again.")
 
-            if self.drag_data["resize"] == "bottom":
-                rect_coords = self.canvas.coords(self.drag_data["item"])
-                new_height = y - rect_coords[1]
-                if new_height > 20:
-                    self.canvas.coords(self.drag_data["item"], rect_coords[0], rect_coords[1], rect_coords[2], y)
+    def compare_plan(self):
+        if self.task is not None:
+            return
 
-                    label_id = self.selected_subnet['label_id']
-                    self.canvas.coords(label_id, 20, rect_coords[1] + new_height / 2)
-            else:
-                delta_x = x - self.drag_data["x"]
-                delta_y = y - self.drag_data["y"]
-                self.canvas.move(self.drag_data["item"], 0, delta_y)
+        try:
+            if self.summary_entry.get():
+                self.select_summary()
+            if self.plan.summary is None:
+                raise ValueError("Enter a summary address first.")
+        except ValueError as e:
+            messagebox.showerror("Compare Error", str(e))
+            return
+
+        filepath = filedialog.askopenfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("Plan snapshots", "*" + SNAPSHOT_EXTENSION), ("All files", "*.*")]
+        )
+        if not filepath:
+            return
+
+        # Progress is measured in subnets of the current plan compared
+        plan = self.plan
+        self.start_task(self.run_compare, (filepath, plan), len(plan.subnets),
+                        lambda kind, payload: self.finish_compare(kind, payload, plan))
+
+    def run_compare(self, progress, filepath, plan):
+        # A snapshot is compared straight from the mapped file; a CSV is
+        # imported first, with the bar held at zero until the sweep starts
+        if is_snapshot(filepath):
+            with open_snapshot(filepath) as snapshot:
+                other = match_plan(snapshot.plans, plan.summary)
+                if other is None:
+                    raise ValueError(f"{filepath} has no plan for {plan.summary}")
+                return diff_plans(plan, other, progress)
+
+        with open(filepath, "r", newline="") as csvfile:
+            result = import_csv(csvfile, progress=lambda consumed: progress(0))
+        other = match_plan(result.plans, plan.summary)
+        if other is None:
+            raise ValueError(f"{filepath} has no plan for {plan.summary}")
+        return diff_plans(plan, other, progress)
+
+    def finish_compare(self, kind, payload, plan):
+        if kind == 'error':
+            messagebox.showerror("Compare Error", f"An error occurred: {payload}")
+            return
+        if kind != 'done':
+            return
+        if plan is not self.plan or payload.version != plan.version:
+            messagebox.showerror("Compare Error", "The plan changed during the comparison. Compare again.")
+            return
+        if not payload.entries:
+            messagebox.showinfo("Compare", "The plans are identical.")
+            return
+
+        self.diff = payload
+        counts = payload.counts()
+        self.diff_label.config(text="Differences: " + ", ".join(
+            f"{counts[kind]} {kind}" for kind in DIFF_KINDS if counts[kind]
+        ))
+        self.diff_frame.pack(before=self.canvas_frame, pady=5)
+        self.render_visible()
+
+    def clear_diff(self):
+        self.diff = None
+        self.diff_frame.pack_forget()
+        for item in self.diff_items[:self.diff_shown]:
+            self.canvas.itemconfig(item, state="hidden")
+        self.diff_shown = 0
+
+    def merge_differences(self):
+        # Conflicts keep the current subnets unless the user takes the
+        # other plan's side of them
+        diff = self.diff
+        if diff is None:
+            return
+        prefer = "current"
+        conflicts = diff.counts()["conflicting"]
+        if conflicts:
+            answer = messagebox.askyesnocancel(
+                "Merge",
+                f"{conflicts} allocations conflict with the other plan. Take the other plan's version of them?"
+            )
+            if answer is None:
+                return
+            if answer:
+                prefer = "other"
+
+        try:
+            change, skipped = merge_diff(self.plan, diff, prefer)
+        except ValueError as e:
+            messagebox.showerror("Merge Error", str(e))
+            return
 
-                label_id = self.selected_subnet['label_id']
-                self.canvas.move(label_id, 0, delta_y)
+        self.clear_diff()
+        if skipped:
+            messagebox.showinfo("Merge", f"Merged. {len(skipped)} differences involving conflicts were left as they are.")
 
-                self.drag_data["x"] = x
-                self.drag_data["y"] = y
+    def export_diff_report(self):
+        if self.task is not None or self.diff is None:
+            return
 
-    def on_canvas_release(self, event):
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            initialfile="diff.csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if not filepath:
+            return
+
+        # Written to a partial file like an export, so a cancelled or failed
+        # report never leaves a half-written file at the chosen path
+        partial = filepath + ".partial"
+        self.start_task(self.run_diff_report, (self.diff, partial), len(self.diff),
+                        lambda kind, payload: self.finish_diff_report(kind, payload, filepath, partial))
+
+    def run_diff_report(self, progress, diff, partial):
+        with open(partial, "w", newline="") as csvfile:
+            write_diff(diff, csvfile, progress)
+
+    def finish_diff_report(self, kind, payload, filepath, partial):
+        if kind == 'done':
+            os.replace(partial, filepath)
+            messagebox.showinfo("Export Successful", f"Differences exported to {filepath}")
+            return
+
+        if os.path.exists(partial):
+            os.remove(partial)
+        if kind == 'error':
+            messagebox.showerror("Export Error", f"An error occurred during export: {payload}")
+
+    def toggle_profiling(self, event=None):
+        # F12 flips the checkbox; clicking it has already flipped it
+        if event is not None:
+            self.profiling.set(not self.profiling.get())
+        instruments.enabled = self.profiling.get()
+
+        if instruments.enabled:
+            self.save_profile_button.pack(side=tk.LEFT, padx=5, after=self.profile_check)
+            self.update_profile_overlay()
+            return
+
+        self.save_profile_button.pack_forget()
+        if self.profile_job is not None:
+            self.master.after_cancel(self.profile_job)
+            self.profile_job = None
+        if self.profile_item is not None:
+            self.canvas.itemconfig(self.profile_item, state="hidden")
+
+    def update_profile_overlay(self):
+        # Refreshed on a timer rather than per redraw, so timings recorded
+        # by workers show up too and the overlay never slows the renderer
+        self.profile_job = None
+        if not instruments.enabled:
+            return
+
+        text = "\n".join(instruments.summary_lines(PROFILE_OVERLAY_LINES)) or "No timings yet"
+        x = self.canvas.winfo_width() - 10
+        y = self.canvas.canvasy(0) + SUMMARY_BAR_HEIGHT + 10
+        if self.profile_item is None:
+            self.profile_item = self.canvas.create_text(x, y, anchor=tk.NE, justify=tk.RIGHT,
+                                                        font=self.profile_font, fill="navy")
+        self.canvas.coords(self.profile_item, x, y)
+        self.canvas.itemconfig(self.profile_item, text=text, state="normal")
+        self.canvas.tag_raise(self.profile_item)
+        self.profile_job = self.master.after(PROFILE_REFRESH_INTERVAL, self.update_profile_overlay)
+
+    def save_profile(self):
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            initialfile="profile.json",
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+        )
+        if not filepath:
+            return
+
+        try:
+            with open(filepath, "w") as f:
+                instruments.dump(f)
+        except OSError as e:
+            messagebox.showerror("Profile Error", f"An error occurred: {e}")
+            return
+        messagebox.showinfo("Profile Saved", f"Timings and counters saved to {filepath}")
+
+    def on_canvas_press(self, event):
+        y = self.canvas.canvasy(event.y)
+
+        subnet = self.subnet_at(y)
+        slot = self.subnet_slot(subnet) if subnet is not None else None
+        if slot is None:
+            return
+
+        self.selected_subnet = subnet
+        rect_coords = self.canvas.coords(slot['rect_id'])
+        self.drag_data.update({
+            "y": y,
+            "item": slot['rect_id'],
+            "label_item": slot['label_id'],
+            "resize": "bottom" if abs(y - rect_coords[3]) < 5 else None,
+            "origin": tuple(rect_coords),
+            "pointer": None,
+            "target": None,
+        })
+
+    def on_canvas_drag(self, event):
+        # Only remember the pointer; the items are updated once per frame
+        # however many motion events arrive in between
         if self.selected_subnet and self.drag_data["item"]:
-            if self.drag_data["resize"] == "bottom":
-                # Update subnet size
-                rect_coords = self.canvas.coords(self.selected_subnet['rect_id'])
-                start_y = rect_coords[1]
-                end_y = rect_coords[3]
-
-                canvas_height = self.canvas.winfo_height()
-                summary_network = ipaddress.ip_network(self.summary_entry.get(), strict=False)
-                total_addresses = summary_network.num_addresses
-                new_subnet_height = end_y - start_y
-                new_subnet_ratio = new_subnet_height / (canvas_height - 40)
-                new_num_addresses = int(total_addresses * new_subnet_ratio)
-
-                new_prefix_length = int(32 - (new_num_addresses - 1).bit_length())
-
-                self.selected_subnet['network'] = ipaddress.ip_network(f"{self.selected_subnet['network'].network_address}/{new_prefix_length}", strict=False)
-                self.subnets.sort(key=lambda x: x['network'].network_address)
-                self.visualize_subnets(summary_network)
-            else:
-                # Move subnet
-                rect_coords = self.canvas.coords(self.selected_subnet['rect_id'])
-                start_y = rect_coords[1]
-
-                canvas_height = self.canvas.winfo_height()
-                summary_network = ipaddress.ip_network(self.summary_entry.get(), strict=False)
-                total_addresses = summary_network.num_addresses
-                new_position_ratio = (start_y - 40) / (canvas_height - 40)
-                new_subnet_address_int = int(summary_network.network_address) + int(total_addresses * new_position_ratio)
-                new_subnet_address = ipaddress.ip_address(new_subnet_address_int)
-
-                self.selected_subnet['network'] = ipaddress.ip_network(f"{new_subnet_address}/{self.selected_subnet['network'].prefixlen}", strict=False)
-
-                # Check for overlaps and revert if necessary
-                temp_subnets = self.subnets[:]
-                self.subnets.sort(key=lambda x: x['network'].network_address)
-                for i, subnet in enumerate(self.subnets):
-                    if i > 0 and subnet['network'].overlaps(self.subnets[i - 1]['network']):
-                        messagebox.showerror("Error", "Subnet move causes overlap. Reverting.")
-                        self.subnets = temp_subnets
-                        break
-
-                self.visualize_subnets(summary_network)
+            self.drag_data["pointer"] = self.canvas.canvasy(event.y)
+            if self.drag_data["frame"] is None:
+                self.drag_data["frame"] = self.master.after(DRAG_FRAME_INTERVAL, self.update_drag)
+
+    def update_drag(self):
+        self.drag_data["frame"] = None
+        subnet = self.selected_subnet
+        if subnet is None or self.drag_data["pointer"] is None:
+            return
 
+        x0, y0, x1, y1 = self.drag_data["origin"]
+        delta_y = self.drag_data["pointer"] - self.drag_data["y"]
+        max_prefixlen = self.plan.summary.max_prefixlen
+
+        if self.drag_data["resize"] == "bottom":
+            # The layout maps the new height back to a prefix length on
+            # whichever scale it was drawn with
+            bottom = max(y1 + delta_y, y0 + MIN_SUBNET_HEIGHT)
+            self.canvas.coords(self.drag_data["item"], x0, y0, x1, bottom)
+            self.canvas.coords(self.drag_data["label_item"], 20, (y0 + bottom) / 2)
+            prefixlen = self.layout.prefixlen_for_height(bottom - y0)
+            host_bits = max_prefixlen - prefixlen
+            start = subnet.start >> host_bits << host_bits
+        else:
+            # Address under the new top edge, aligned down to the prefix
+            top = y0 + delta_y
+            self.canvas.coords(self.drag_data["item"], x0, top, x1, y1 + delta_y)
+            self.canvas.coords(self.drag_data["label_item"], 20, top + (y1 - y0) / 2)
+            prefixlen = subnet.prefixlen
+            host_bits = max_prefixlen - prefixlen
+            start = self.layout.address_at(top) >> host_bits << host_bits
+
+        # Snap preview, checked against the allocation index in O(log n) and
+        # against any plan nested under the subnet
+        target = network_from_int(subnet.version, start, prefixlen)
+        valid = self.plan.can_relocate(subnet, target)
+        self.drag_data["target"] = target if valid else None
+        self.show_snap(start, start + (1 << host_bits), valid)
+
+    def show_snap(self, first, end, valid):
+        # Outline where the drop would land: green if allowed, red if not
+        coords = (10, self.layout.y_for_address(first), self.canvas.winfo_width() - 10, self.layout.y_for_address(end))
+        state = (coords, valid)
+        if self.snap_item is None:
+            if instruments.enabled:
+                instruments.count("canvas.items_created")
+            self.snap_item = self.canvas.create_rectangle(*coords, width=2, dash=(4, 2), state="hidden")
+        if self.snap_state != state:
+            self.canvas.coords(self.snap_item, *coords)
+            self.canvas.itemconfig(self.snap_item, outline="green" if valid else "red", state="normal")
+            self.snap_state = state
+
+    def hide_snap(self):
+        if self.snap_item is not None and self.snap_state is not None:
+            self.canvas.itemconfig(self.snap_item, state="hidden")
+            self.snap_state = None
+
+    def on_canvas_release(self, event):
+        if self.selected_subnet and self.drag_data["item"]:
+            # Apply the last motion that is still waiting for its frame
+            if self.drag_data["frame"] is not None:
+                self.master.after_cancel(self.drag_data["frame"])
+                self.update_drag()
+            self.hide_snap()
+
+            # The drag moved the row's items directly, so redraw it either
+            # way. The drag ends first, so the render releases its slot if
+            # the row has scrolled out of view.
+            subnet = self.selected_subnet
+            self.invalidate_row(subnet)
+            target, pointer, resize = self.drag_data["target"], self.drag_data["pointer"], self.drag_data["resize"]
             self.selected_subnet = None
-            self.drag_data["item"] = None
-            self.drag_data["resize"] = None
+            self.drag_data.update({"item": None, "label_item": None, "resize": None,
+                                   "origin": None, "pointer": None, "target": None})
+
+            if pointer is None:
+                # A click without a drag
+                self.render_visible()
+            elif target is None:
+                action = "resize" if resize == "bottom" else "move"
+                messagebox.showerror("Error", f"Subnet {action} causes overlap, leaves the summary or cuts off "
+                                              f"a nested plan. Reverting.")
+                self.render_visible()
+            elif (target.version, int(target.network_address), target.prefixlen) == (subnet.version, subnet.start, subnet.prefixlen):
+                self.render_visible()
+            else:
+                description = "Resize subnet" if resize == "bottom" else "Move subnet"
+                self.plan.relocate_subnet(subnet, target, description)
 
     def on_canvas_double_click(self, event):
-        x = self.canvas.canvasx(event.x)
         y = self.canvas.canvasy(event.y)
 
-        canvas_item = self.canvas.find_closest(x, y)
-        tags = self.canvas.gettags(canvas_item)
+        subnet_to_edit = self.subnet_at(y)
+        if subnet_to_edit:
+            self.edit_subnet(subnet_to_edit)
+
+    def on_canvas_drill_down(self, event):
+        y = self.canvas.canvasy(event.y)
 
-        if "subnet" in tags:
-            label = tags[1]
-            subnet_to_edit = next((s for s in self.subnets if s['label'] == label), None)
-            if subnet_to_edit:
-                self.edit_subnet(subnet_to_edit)
+        subnet = self.subnet_at(y)
+        if subnet:
+            self.drill_down(subnet)
 
     def edit_subnet(self, subnet):
         edit_window = tk.Toplevel(self.master)
@@ -384,12 +1115,12 @@ class SubnetVisualizer:
 
         tk.Label(edit_window, text="Label:").grid(row=0, column=0, padx=5, pady=5)
         label_entry = tk.Entry(edit_window)
-        label_entry.insert(0, subnet['label'])
+        label_entry.insert(0, subnet.label)
         label_entry.grid(row=0, column=1, padx=5, pady=5)
 
         tk.Label(edit_window, text="Network (CIDR):").grid(row=1, column=0, padx=5, pady=5)
         network_entry = tk.Entry(edit_window)
-        network_entry.insert(0, str(subnet['network']))
+        network_entry.insert(0, str(subnet.network))
         network_entry.grid(row=1, column=1, padx=5, pady=5)
 
         def save_changes():
@@ -397,68 +1128,75 @@ class SubnetVisualizer:
             new_network_str = network_entry.get()
 
             try:
-                new_network = ipaddress.ip_network(new_network_str, strict=False)
+                new_network = parse_network(new_network_str)
             except ValueError:
                 messagebox.showerror("Error", "Invalid subnet address.")
                 return
 
-            for existing_subnet in self.subnets:
-                if existing_subnet is not subnet and existing_subnet['network'].overlaps(new_network):
-                    messagebox.showerror("Error", f"Subnet overlaps with existing subnet: {existing_subnet['label']}")
-                    return
-
-            subnet['label'] = new_label
-            subnet['network'] = new_network
-
-            self.canvas.itemconfig(subnet['rect_id'], tags=("subnet", new_label))
+            try:
+                self.plan.update_subnet(subnet, new_label, new_network)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
 
-            self.subnets.sort(key=lambda x: x['network'].network_address)
-            self.visualize_subnets(ipaddress.ip_network(self.summary_entry.get(), strict=False))
             edit_window.destroy()
 
         save_button = tk.Button(edit_window, text="Save Changes", command=save_changes)
         save_button.grid(row=2, column=0, columnspan=2, pady=10)
 
     def on_canvas_resize(self, event):
-        if self.summary_entry.get():
-            summary_network = ipaddress.ip_network(self.summary_entry.get(), strict=False)
-            self.visualize_subnets(summary_network)
+        # Dragging the window edge fires a burst of these; repaint once the
+        # size has settled
+        if self.resize_job is not None:
+            self.master.after_cancel(self.resize_job)
+        self.resize_job = self.master.after(RESIZE_DEBOUNCE_INTERVAL, self.finish_resize)
+
+    def finish_resize(self):
+        self.resize_job = None
+        if self.plan.summary is not None:
+            self.visualize_subnets(self.plan.summary)
 
     def on_canvas_scroll(self, event):
         self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
 
     def optimize_subnets(self):
+        if self.task is not None:
+            return
         if not self.subnets or not self.summary_entry.get():
             messagebox.showwarning("Warning", "No subnets to optimize or no summary address set.")
             return
 
         try:
-            summary_network = ipaddress.ip_network(self.summary_entry.get(), strict=False)
-            
-            # Sort subnets by size (largest first)
-            self.subnets.sort(key=lambda x: x['network'].num_addresses, reverse=True)
-            
-            # Start placing from the lowest usable address
-            current_address = summary_network.network_address
-            
-            # Place each subnet consecutively without gaps
-            for subnet in self.subnets:
-                new_network = ipaddress.ip_network(f"{current_address}/{subnet['network'].prefixlen}", strict=False)
-                
-                if new_network.broadcast_address >= summary_network.broadcast_address:
-                    messagebox.showerror("Error", "Not enough space to optimize subnets")
-                    return
-                
-                subnet['network'] = new_network
-                current_address = new_network.broadcast_address + 1
-            
-            # Sort by network address to maintain visual order
-            self.subnets.sort(key=lambda x: x['network'].network_address)
-            self.visualize_subnets(summary_network)
-            
+            self.select_summary()
+        except ValueError as e:
+            messagebox.showerror("Optimization Error", f"An error occurred: {e}")
+            return
+
+        # The new layout is computed off the UI thread and applied as one
+        # change at the end, unless the plan was edited in the meantime
+        plan = self.plan
+        self.start_task(self.run_optimize, (plan, self.minimize_moves.get()), len(plan.subnets),
+                        lambda kind, payload: self.finish_optimize(kind, payload, plan))
+
+    def run_optimize(self, progress, plan, minimize_moves):
+        return plan.plan_optimization(minimize_moves, progress)
+
+    def finish_optimize(self, kind, payload, plan):
+        if kind == 'cancelled':
+            return
+        if kind == 'error':
+            messagebox.showerror("Optimization Error", f"An error occurred: {payload}")
+            return
+
+        try:
+            report = plan.apply_optimization(payload)
+            messagebox.showinfo("Optimization Complete", str(report))
+
         except Exception as e:
             messagebox.showerror("Optimization Error", f"An error occurred: {e}")
 
-root = tk.Tk()
-app = SubnetVisualizer(root)
-root.mainloop()
\ No newline at end of file
+
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = SubnetVisualizer(root)
+    root.mainloop()
@@ -0,0 +1,213 @@
+import bisect
+import csv
+
+from subnet_engine import Change, Subnet, PROGRESS_CHUNK_SIZE, address_column
+from instrumentation import instruments
+
+DIFF_KINDS = ("added", "removed", "resized", "relabelled", "conflicting")
+DIFF_HEADER = ["Change", "Current Label", "Current Subnet", "Other Label", "Other Subnet"]
+
+
+class DiffEntry:
+    # One difference between the current plan and another one. `current`
+    # and `other` are the subnet records on each side, None where absent.
+    __slots__ = ('kind', 'current', 'other')
+
+    def __init__(self, kind, current, other):
+        self.kind = kind
+        self.current = current
+        self.other = other
+
+    def __repr__(self):
+        return f"DiffEntry({self.kind!r}, {self.current!r}, {self.other!r})"
+
+    @property
+    def first(self):
+        return min(subnet.start for subnet in (self.current, self.other) if subnet is not None)
+
+    @property
+    def last(self):
+        return max(subnet.end for subnet in (self.current, self.other) if subnet is not None)
+
+
+class PlanDiff:
+    # Every difference between two plans, in address order. `plan` and
+    # `version` identify the current plan it was computed against, so a
+    # diff that has gone stale can be told apart.
+    def __init__(self, plan, entries):
+        self.plan = plan
+        self.version = getattr(plan, "version", None)
+        entries.sort(key=lambda entry: entry.first)
+        self.entries = entries
+        self.firsts = address_column(entry.first for entry in entries)
+        # Running maximum of the last addresses: entries overlap each other
+        # where a conflict spans several blocks, so the lasts alone are not
+        # sorted, but their running maximum is and can be bisected
+        reach = []
+        furthest = -1
+        for entry in entries:
+            furthest = max(furthest, entry.last)
+            reach.append(furthest)
+        self.reach = address_column(reach)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def counts(self):
+        counts = dict.fromkeys(DIFF_KINDS, 0)
+        for entry in self.entries:
+            counts[entry.kind] += 1
+        return counts
+
+    def within(self, first, last):
+        # Entries touching the address range [first, last]
+        begin = bisect.bisect_left(self.reach, first)
+        end = bisect.bisect_right(self.firsts, last)
+        return [entry for entry in self.entries[begin:end] if entry.last >= first]
+
+
+# Sentinel entry for a plan that has run out of subnets
+EXHAUSTED = (None, None, None)
+
+
+@instruments.timed("diff")
+def diff_plans(current, other, progress=None):
+    # Sorted-merge sweep over two plans in O(n + m). Subnets within a plan
+    # never overlap, so walking both in address order and always advancing
+    # the side that ends first visits every overlapping pair exactly once.
+    # Matching starts and sizes are unchanged or relabelled, a matching
+    # start with another size is resized, any other overlap conflicts, and
+    # what overlaps nothing was added or removed.
+    # `progress(consumed)` is called with the number of current subnets
+    # passed every PROGRESS_CHUNK_SIZE steps.
+    if current.summary is not None and other.summary is not None and current.summary.version != other.summary.version:
+        raise ValueError(f"Cannot compare {current.summary} with {other.summary}")
+
+    entries = []
+    currents = iter(current.entries())
+    others = iter(other.entries())
+    a_start, a_end, a = next(currents, EXHAUSTED)
+    b_start, b_end, b = next(others, EXHAUSTED)
+    # Whether the subnet on each side already appears in an entry
+    a_seen = b_seen = False
+    consumed = steps = 0
+
+    while a is not None or b is not None:
+        steps += 1
+        if progress is not None and steps % PROGRESS_CHUNK_SIZE == 0:
+            progress(consumed)
+
+        # Identical blocks are the common case, so they are tested first;
+        # an exhausted side never matches the other's integer bounds
+        if a_start == b_start and a_end == b_end:
+            if a.label != b.label:
+                entries.append(DiffEntry("relabelled", a, b))
+            a_start, a_end, a = next(currents, EXHAUSTED)
+            b_start, b_end, b = next(others, EXHAUSTED)
+            a_seen = b_seen = False
+            consumed += 1
+        elif b is None or (a is not None and a_end < b_start):
+            if not a_seen:
+                entries.append(DiffEntry("removed", a, None))
+            a_start, a_end, a = next(currents, EXHAUSTED)
+            a_seen = False
+            consumed += 1
+        elif a is None or b_end < a_start:
+            if not b_seen:
+                entries.append(DiffEntry("added", None, b))
+            b_start, b_end, b = next(others, EXHAUSTED)
+            b_seen = False
+        else:
+            entries.append(DiffEntry("resized" if a_start == b_start else "conflicting", a, b))
+            a_seen = b_seen = True
+            passed_a, passed_b = a_end <= b_end, b_end <= a_end
+            if passed_a:
+                a_start, a_end, a = next(currents, EXHAUSTED)
+                a_seen = False
+                consumed += 1
+            if passed_b:
+                b_start, b_end, b = next(others, EXHAUSTED)
+                b_seen = False
+
+    return PlanDiff(current, entries)
+
+
+def match_plan(plans, summary):
+    # The plan among `plans` to compare with a summary: the one with the
+    # same summary, else the first overlapping it, else a lone plan
+    if summary is not None:
+        for plan in plans:
+            if plan.summary == summary:
+                return plan
+        for plan in plans:
+            if plan.summary is not None and plan.summary.version == summary.version and plan.summary.overlaps(summary):
+                return plan
+    if len(plans) == 1:
+        return plans[0]
+    return None
+
+
+def merge_diff(plan, diff, prefer="current"):
+    # Bring `plan` in line with the other side of a diff as one undoable
+    # change. Conflicts keep the current subnets unless `prefer` is
+    # "other", and so does every change involving a subnet in a conflict.
+    # Returns the change, or None if nothing was merged, and the entries
+    # left out.
+    if diff.plan is not plan or diff.version != plan.version:
+        raise ValueError("The plan changed since it was compared. Compare again.")
+
+    tangled = set()
+    if prefer == "current":
+        for entry in diff.entries:
+            if entry.kind == "conflicting":
+                tangled.add(id(entry.current))
+                tangled.add(id(entry.other))
+
+    # id of a current subnet -> [subnet, before, after]
+    changed = {}
+    added = {}
+    skipped = []
+    for entry in diff.entries:
+        current, other = entry.current, entry.other
+        if id(current) in tangled or id(other) in tangled:
+            skipped.append(entry)
+            continue
+        if other is not None and not plan.contains(other.network):
+            raise ValueError(f"Subnet {other.label} ({other.network}) is outside {plan.summary}")
+
+        if current is not None and id(current) not in changed:
+            changed[id(current)] = [current, current.state(), None]
+        if other is None or id(other) in added:
+            continue
+        # A resized or relabelled subnet keeps its record, so undo and any
+        # summary nested under it follow the change
+        if entry.kind in ("resized", "relabelled") and changed[id(current)][2] is None:
+            changed[id(current)][2] = other.state()
+            added[id(other)] = None
+        else:
+            added[id(other)] = (Subnet(other.label, other.version, other.start, other.prefixlen), None, other.state())
+
+    deltas = [tuple(delta) for delta in changed.values()]
+    deltas.extend(delta for delta in added.values() if delta is not None)
+    if not deltas:
+        return None, skipped
+    return plan.apply(Change("Merge", deltas)), skipped
+
+
+def write_diff(diff, csvfile, progress=None):
+    # Laid out like a document section: the summary, then the header row.
+    # `progress(written)` is called every PROGRESS_CHUNK_SIZE entries.
+    writer = csv.writer(csvfile)
+    if diff.plan.summary is not None:
+        writer.writerow(["Summary", str(diff.plan.summary)])
+    writer.writerow(DIFF_HEADER)
+    for written, entry in enumerate(diff.entries, 1):
+        if progress is not None and written % PROGRESS_CHUNK_SIZE == 0:
+            progress(written)
+        row = [entry.kind]
+        for subnet in (entry.current, entry.other):
+            row.extend([subnet.label, str(subnet.network)] if subnet is not None else ["", ""])
+        writer.writerow(row)
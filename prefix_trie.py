@@ -0,0 +1,155 @@
+class TrieNode:
+    __slots__ = ('start', 'prefixlen', 'value', 'children')
+
+    def __init__(self, start, prefixlen, value=None):
+        self.start = start
+        self.prefixlen = prefixlen
+        self.value = value
+        self.children = [None, None]
+
+
+class PrefixTrie:
+    # Path-compressed binary trie of CIDR blocks, one root per IP version.
+    # Nodes only exist where a block was stored or where two branches part,
+    # so a lookup follows at most one node per prefix bit: O(prefix length)
+    # however many blocks are stored. Keys are (version, start, prefixlen)
+    # with integer starts, like the subnet records.
+    def __init__(self):
+        self._roots = {4: TrieNode(0, 0), 6: TrieNode(0, 0)}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        # Values in address order, every block before the blocks inside it
+        for version in (4, 6):
+            yield from self._values(self._roots[version])
+
+    @staticmethod
+    def _max_prefixlen(version):
+        return 32 if version == 4 else 128
+
+    @staticmethod
+    def _contains(node, start, prefixlen, max_prefixlen):
+        host_bits = max_prefixlen - node.prefixlen
+        return node.prefixlen <= prefixlen and start >> host_bits == node.start >> host_bits
+
+    @staticmethod
+    def _bit(start, prefixlen, max_prefixlen):
+        # The first bit after a /prefixlen, which picks the child
+        return start >> (max_prefixlen - prefixlen - 1) & 1
+
+    def _values(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                yield node.value
+            stack.extend(child for child in reversed(node.children) if child is not None)
+
+    def _path(self, version, start, prefixlen):
+        # Nodes from the root down to the deepest one containing the key
+        max_prefixlen = self._max_prefixlen(version)
+        node = self._roots[version]
+        path = [node]
+        while node.prefixlen < prefixlen:
+            child = node.children[self._bit(start, node.prefixlen, max_prefixlen)]
+            if child is None or not self._contains(child, start, prefixlen, max_prefixlen):
+                break
+            node = child
+            path.append(node)
+        return path
+
+    def insert(self, version, start, prefixlen, value):
+        max_prefixlen = self._max_prefixlen(version)
+        node = self._path(version, start, prefixlen)[-1]
+        if node.prefixlen == prefixlen:
+            if node.value is None:
+                self._size += 1
+            node.value = value
+            return
+
+        self._size += 1
+        bit = self._bit(start, node.prefixlen, max_prefixlen)
+        child = node.children[bit]
+        new = TrieNode(start, prefixlen, value)
+        if child is None:
+            node.children[bit] = new
+        elif self._contains(new, child.start, child.prefixlen, max_prefixlen):
+            # The new block sits between the node and its child
+            new.children[self._bit(child.start, prefixlen, max_prefixlen)] = child
+            node.children[bit] = new
+        else:
+            # Neither holds the other: branch where their bits first differ
+            common = max_prefixlen - (start ^ child.start).bit_length()
+            host_bits = max_prefixlen - common
+            branch = TrieNode(start >> host_bits << host_bits, common)
+            branch.children[self._bit(start, common, max_prefixlen)] = new
+            branch.children[self._bit(child.start, common, max_prefixlen)] = child
+            node.children[bit] = branch
+
+    def remove(self, version, start, prefixlen):
+        path = self._path(version, start, prefixlen)
+        node = path[-1]
+        if node.prefixlen != prefixlen or node.value is None:
+            raise KeyError("Block is not in the trie")
+        node.value = None
+        self._size -= 1
+
+        # Drop nodes that no longer store a block or part two branches
+        while len(path) > 1 and path[-1].value is None:
+            node = path.pop()
+            children = [child for child in node.children if child is not None]
+            if len(children) > 1:
+                break
+            parent = path[-1]
+            parent.children[parent.children.index(node)] = children[0] if children else None
+
+    def get(self, version, start, prefixlen):
+        node = self._path(version, start, prefixlen)[-1]
+        return node.value if node.prefixlen == prefixlen else None
+
+    def longest_match(self, version, start, prefixlen, strict=False):
+        # Value of the innermost block containing the key (or strictly
+        # containing it), or None
+        for node in reversed(self._path(version, start, prefixlen)):
+            if node.value is not None and not (strict and node.prefixlen == prefixlen):
+                return node.value
+        return None
+
+    def ancestors(self, version, start, prefixlen):
+        # Values of every block strictly containing the key, outermost first
+        return [node.value for node in self._path(version, start, prefixlen)
+                if node.value is not None and node.prefixlen < prefixlen]
+
+    def _subtree_root(self, version, start, prefixlen):
+        # Topmost node inside the key's block, or None
+        max_prefixlen = self._max_prefixlen(version)
+        node = self._path(version, start, prefixlen)[-1]
+        if node.prefixlen >= prefixlen:
+            return node
+        child = node.children[self._bit(start, node.prefixlen, max_prefixlen)]
+        if child is not None and self._contains(TrieNode(start, prefixlen), child.start, child.prefixlen, max_prefixlen):
+            return child
+        return None
+
+    def subtree(self, version, start, prefixlen):
+        # Values of the key's block and every block inside it, in order
+        node = self._subtree_root(version, start, prefixlen)
+        return self._values(node) if node is not None else iter(())
+
+    def children(self, version, start, prefixlen):
+        # Values of the outermost blocks strictly inside the key's block
+        node = self._subtree_root(version, start, prefixlen)
+        if node is None:
+            return []
+        stack = [node] if node.prefixlen > prefixlen else [child for child in reversed(node.children) if child]
+        found = []
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                found.append(node.value)
+            else:
+                stack.extend(child for child in reversed(node.children) if child is not None)
+        return found
@@ -0,0 +1,372 @@
+import bisect
+import gc
+import mmap
+import struct
+import sys
+from array import array
+
+from subnet_engine import SubnetPlan, Subnet, network_from_int, PROGRESS_CHUNK_SIZE
+from instrumentation import instruments
+
+# Binary plan snapshots: a header, one directory entry per plan, then each
+# plan's fixed-width little-endian columns, 8-byte aligned:
+#   start_lo  u64 per subnet, the low 64 bits of the network address
+#   start_hi  u64 per subnet, the high 64 bits (IPv6 plans only)
+#   prefixlen u8 per subnet
+#   label_id  u32 per subnet, an index into the plan's label table
+#   label_end u64 per distinct label, the end offset of each label in
+#             the UTF-8 label blob that follows
+# Subnets are stored in address order, so the start columns can be
+# bisected straight out of the mapped file.
+SNAPSHOT_MAGIC = b"SUBNSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = ".snap"
+
+HEADER = struct.Struct("<8sII")
+# ip version, summary prefix length (NO_SUMMARY if unset), summary address
+# high/low, subnet count, label count, then the offsets of start_lo,
+# start_hi, prefixlen, label_id, label_end and the label blob, and the
+# blob's size
+PLAN_ENTRY = struct.Struct("<BB6x11Q")
+NO_SUMMARY = 0xFF
+
+LOW_MASK = (1 << 64) - 1
+
+
+def is_snapshot(filepath):
+    with open(filepath, "rb") as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def _column(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _padded(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+@instruments.timed("export.snapshot")
+def write_snapshot(plans, f, progress=None):
+    # Columns are built plan by plan; `progress(written)` is called every
+    # PROGRESS_CHUNK_SIZE subnets
+    blocks = []
+    entries = []
+    offset = HEADER.size + PLAN_ENTRY.size * len(plans)
+    written = 0
+
+    for plan in plans:
+        subnets = list(plan.subnets)
+        summary = plan.summary
+        version = summary.version if summary is not None else (subnets[0].version if subnets else 4)
+
+        labels = {}
+        start_lo = array('Q')
+        start_hi = array('Q')
+        prefixlens = array('B')
+        label_ids = array('I')
+        for subnet in subnets:
+            written += 1
+            if progress is not None and written % PROGRESS_CHUNK_SIZE == 0:
+                progress(written)
+            start_lo.append(subnet.start & LOW_MASK)
+            if version == 6:
+                start_hi.append(subnet.start >> 64)
+            prefixlens.append(subnet.prefixlen)
+            label_ids.append(labels.setdefault(subnet.label, len(labels)))
+
+        encoded = [label.encode("utf-8") for label in labels]
+        label_ends = array('Q')
+        end = 0
+        for label in encoded:
+            end += len(label)
+            label_ends.append(end)
+        blob = b"".join(encoded)
+
+        columns = [
+            _column('Q', start_lo),
+            _column('Q', start_hi),
+            _column('B', prefixlens),
+            _column('I', label_ids),
+            _column('Q', label_ends),
+            blob,
+        ]
+        offsets = []
+        for column in columns:
+            offsets.append(offset)
+            blocks.append(_padded(column))
+            offset += len(blocks[-1])
+
+        if summary is not None:
+            summary_start = int(summary.network_address)
+            summary_prefixlen = summary.prefixlen
+        else:
+            summary_start, summary_prefixlen = 0, NO_SUMMARY
+        entries.append(PLAN_ENTRY.pack(
+            version, summary_prefixlen, summary_start >> 64, summary_start & LOW_MASK,
+            len(subnets), len(labels), *offsets, len(blob)
+        ))
+
+    f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(plans)))
+    for entry in entries:
+        f.write(entry)
+    for block in blocks:
+        f.write(block)
+
+
+def save_snapshot(plans, filepath, progress=None):
+    with open(filepath, "wb") as f:
+        write_snapshot(plans, f, progress)
+
+
+def _entry_end(entry):
+    # End of the last byte a directory entry's columns refer to
+    version, _, _, _, count, label_count, start_lo, start_hi, prefixlens, label_ids, label_ends, blob, blob_size = entry
+    return max(start_lo + 8 * count, start_hi + (8 * count if version == 6 else 0), prefixlens + count,
+               label_ids + 4 * count, label_ends + 8 * label_count, blob + blob_size)
+
+
+def _view(buffer, offset, count, typecode, size):
+    # A column of `count` little-endian items of `size` bytes. It is viewed
+    # in place in the mapped file, except on a big-endian host, which
+    # reads a byte-swapped copy.
+    view = buffer[offset:offset + size * count]
+    if sys.byteorder == "little":
+        return view.cast(typecode)
+    column = array(typecode, view.tobytes())
+    view.release()
+    column.byteswap()
+    return memoryview(column)
+
+
+class WideColumn:
+    # IPv6 starts as one sequence over the high and low columns, so bisect
+    # can search them without building the integers up front
+    def __init__(self, high, low):
+        self.high = high
+        self.low = low
+
+    def __len__(self):
+        return len(self.low)
+
+    def __getitem__(self, i):
+        return self.high[i] << 64 | self.low[i]
+
+
+class SnapshotRows:
+    # Read-only sequence of Subnet records built on access from the mapped
+    # columns; nothing is read until a row is asked for
+    def __init__(self, plan):
+        self.plan = plan
+
+    def __len__(self):
+        return len(self.plan)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.plan.row(j) for j in range(*i.indices(len(self.plan)))]
+        if i < 0:
+            i += len(self.plan)
+        if not 0 <= i < len(self.plan):
+            raise IndexError("snapshot row out of range")
+        return self.plan.row(i)
+
+    def __iter__(self):
+        for i in range(len(self.plan)):
+            yield self.plan.row(i)
+
+
+class SnapshotPlan:
+    # One plan of a mapped snapshot. Columns are memoryviews into the file,
+    # so opening costs nothing per row; rows are decoded lazily.
+    def __init__(self, buffer, entry):
+        (self.version, summary_prefixlen, summary_hi, summary_lo, count, label_count,
+         start_lo, start_hi, prefixlens, label_ids, label_ends, blob, blob_size) = entry
+        if self.version not in (4, 6):
+            raise ValueError(f"unknown IP version {self.version}")
+
+        self.summary = None
+        if summary_prefixlen != NO_SUMMARY:
+            self.summary = network_from_int(self.version, summary_hi << 64 | summary_lo, summary_prefixlen)
+
+        self._count = count
+        self._start_lo = _view(buffer, start_lo, count, 'Q', 8)
+        self._start_hi = _view(buffer, start_hi, count, 'Q', 8) if self.version == 6 else None
+        self._prefixlens = buffer[prefixlens:prefixlens + count]
+        self._label_ids = _view(buffer, label_ids, count, 'I', 4)
+        self._label_ends = _view(buffer, label_ends, label_count, 'Q', 8)
+        self._blob = buffer[blob:blob + blob_size]
+        self._labels = [None] * label_count
+        self.starts = self._start_lo if self.version == 4 else WideColumn(self._start_hi, self._start_lo)
+
+    def __len__(self):
+        return self._count
+
+    def check(self):
+        # Label ids and prefix lengths are read unchecked later, so a bad
+        # one is caught once here instead of as an IndexError mid-export
+        if self._count and max(self._label_ids) >= len(self._labels):
+            raise ValueError(f"label id {max(self._label_ids)} is past the {len(self._labels)} labels")
+        max_prefixlen = 32 if self.version == 4 else 128
+        if self._count and max(self._prefixlens) > max_prefixlen:
+            raise ValueError(f"prefix length {max(self._prefixlens)} is over {max_prefixlen}")
+
+    @property
+    def subnets(self):
+        return SnapshotRows(self)
+
+    def entries(self):
+        # (start, end, subnet) for every row in address order, built lazily
+        max_prefixlen = 32 if self.version == 4 else 128
+        for i in range(self._count):
+            subnet = self.row(i)
+            yield subnet.start, subnet.start + (1 << (max_prefixlen - subnet.prefixlen)) - 1, subnet
+
+    def label(self, label_id):
+        label = self._labels[label_id]
+        if label is None:
+            begin = self._label_ends[label_id - 1] if label_id else 0
+            label = sys.intern(str(self._blob[begin:self._label_ends[label_id]], "utf-8"))
+            self._labels[label_id] = label
+        return label
+
+    def row(self, i):
+        return Subnet(self.label(self._label_ids[i]), self.version, self.starts[i], self._prefixlens[i])
+
+    def find(self, address):
+        # Subnet holding an address, by bisecting the mapped start column
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i >= 0:
+            subnet = self.row(i)
+            if subnet.end >= address:
+                return subnet
+        return None
+
+    def release(self):
+        for view in (self._start_lo, self._start_hi, self._prefixlens, self._label_ids, self._label_ends, self._blob):
+            if view is not None:
+                view.release()
+
+    def labels(self):
+        # Every label in the table, decoded in one pass when it is ASCII
+        ends = self._label_ends.tolist()
+        begins = [0] + ends[:-1]
+        blob = bytes(self._blob)
+        if blob.isascii():
+            text = blob.decode("ascii")
+            return [sys.intern(text[begin:end]) for begin, end in zip(begins, ends)]
+        return [sys.intern(str(blob[begin:end], "utf-8")) for begin, end in zip(begins, ends)]
+
+    def to_plan(self, progress=None):
+        # A full SubnetPlan. Each column is copied out in one C-level pass
+        # and the records built from plain ints, so no text is parsed and no
+        # ipaddress objects are made.
+        labels = self.labels()
+        starts = self._start_lo.tolist()
+        if self.version == 6:
+            starts = [high << 64 | low for high, low in zip(self._start_hi.tolist(), starts)]
+        prefixlens = self._prefixlens.tolist()
+        label_ids = self._label_ids.tolist()
+
+        max_prefixlen = 32 if self.version == 4 else 128
+        sizes = [(1 << (max_prefixlen - prefixlen)) - 1 for prefixlen in range(max_prefixlen + 1)]
+        ends = [start + sizes[prefixlen] for start, prefixlen in zip(starts, prefixlens)]
+
+        # Collection passes triggered by a million new records find nothing
+        # to free, so the collector is paused while they are built
+        subnets = []
+        version = self.version
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for i in range(0, self._count, PROGRESS_CHUNK_SIZE):
+                if progress is not None:
+                    progress(i)
+                chunk = slice(i, i + PROGRESS_CHUNK_SIZE)
+                subnets += [Subnet(labels[label_id], version, start, prefixlen)
+                            for start, prefixlen, label_id in zip(starts[chunk], prefixlens[chunk], label_ids[chunk])]
+        finally:
+            if collecting:
+                gc.enable()
+
+        plan = SubnetPlan(self.summary)
+        plan.load_columns(starts, ends, subnets)
+        return plan
+
+
+class Snapshot:
+    # A snapshot file mapped read-only; see _view() for how columns are read
+    def __init__(self, filepath):
+        self._file = open(filepath, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{filepath} is not a plan snapshot")
+        self._buffer = memoryview(self._map)
+
+        if len(self._buffer) < HEADER.size:
+            self.close()
+            raise ValueError(f"{filepath} is not a plan snapshot")
+        magic, version, plan_count = HEADER.unpack_from(self._buffer, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"{filepath} is not a plan snapshot")
+        if version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported snapshot version {version}")
+
+        self.plans = []
+        if HEADER.size + plan_count * PLAN_ENTRY.size > len(self._buffer):
+            self.close()
+            raise ValueError(f"{filepath} is truncated")
+        for i in range(plan_count):
+            entry = PLAN_ENTRY.unpack_from(self._buffer, HEADER.size + i * PLAN_ENTRY.size)
+            if _entry_end(entry) > len(self._buffer):
+                self.close()
+                raise ValueError(f"{filepath} is truncated")
+            try:
+                self.plans.append(SnapshotPlan(self._buffer, entry))
+                self.plans[-1].check()
+            except ValueError as e:
+                self.close()
+                raise ValueError(f"{filepath} is corrupted: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return sum(len(plan) for plan in self.plans)
+
+    def close(self):
+        for plan in getattr(self, "plans", ()):
+            plan.release()
+        self._buffer.release()
+        self._map.close()
+        self._file.close()
+
+
+def open_snapshot(filepath):
+    return Snapshot(filepath)
+
+
+@instruments.timed("import.snapshot")
+def load_snapshot(filepath, progress=None):
+    # Every plan of a snapshot as a SubnetPlan; `progress(loaded)` is
+    # called with the number of subnets loaded so far
+    with open_snapshot(filepath) as snapshot:
+        plans = []
+        loaded = 0
+        for snapshot_plan in snapshot.plans:
+            offset = loaded
+            plans.append(snapshot_plan.to_plan(
+                None if progress is None else (lambda done, offset=offset: progress(offset + done))
+            ))
+            loaded += len(snapshot_plan)
+        return plans
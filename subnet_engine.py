@@ -0,0 +1,1061 @@
+import ipaddress
+import csv
+import bisect
+import sys
+from array import array
+
+from allocator import BuddyAllocator
+from prefix_trie import PrefixTrie
+from instrumentation import instruments
+
+CSV_HEADER = ["Label", "Subnet", "Network Address", "Broadcast Address", "Number of Hosts"]
+REJECTION_HEADER = ["Line", "Label", "Subnet", "Reason"]
+
+# Rows or subnets processed between progress callbacks during an import,
+# export or optimization
+PROGRESS_CHUNK_SIZE = 10000
+
+# Number of changes kept for undo
+HISTORY_LIMIT = 1000
+
+# Changes touching more subnets than this rebuild the index in one pass
+# instead of removing and re-inserting every subnet
+BULK_APPLY_THRESHOLD = 1000
+
+# Bulk changes touching more than this share of a plan drop the free-space
+# index to be rebuilt from the gaps, rather than updating it block by block
+FREE_SPACE_REBUILD_FRACTION = 0.25
+
+
+def parse_network(text):
+    if instruments.enabled:
+        instruments.count("ipaddress.parsed")
+    return ipaddress.ip_network(text.strip(), strict=False)
+
+
+def parse_cidr(text):
+    # (version, network int, prefix length) without building ipaddress
+    # objects for the common dotted-quad case; host bits are masked off
+    # like ip_network(strict=False). Only ASCII digits count, since
+    # str.isdigit() also accepts digits of other scripts.
+    text = text.strip()
+    address, slash, prefix = text.partition('/')
+    octets = address.split('.')
+    if len(octets) == 4 and (not slash or (prefix.isascii() and prefix.isdigit())):
+        value = 0
+        for octet in octets:
+            if not (octet.isascii() and octet.isdigit()) or int(octet) > 255 or (len(octet) > 1 and octet[0] == '0'):
+                raise ValueError(f"{text!r} does not appear to be an IPv4 or IPv6 network")
+            value = value << 8 | int(octet)
+        prefixlen = int(prefix) if slash else 32
+        if prefixlen > 32:
+            raise ValueError(f"Invalid netmask: {prefix}")
+        host_bits = 32 - prefixlen
+        return 4, value >> host_bits << host_bits, prefixlen
+
+    network = parse_network(text)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def network_bounds(network):
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def host_range(network):
+    # First and last usable address. Only IPv4 networks larger than a /31
+    # lose their network and broadcast addresses; IPv6 has no broadcast
+    if network.version == 4 and network.prefixlen < 31:
+        return network.network_address + 1, network.broadcast_address - 1
+    return network.network_address, network.broadcast_address
+
+
+def host_count(network):
+    if network.version == 4 and network.prefixlen < 31:
+        return network.num_addresses - 2
+    return network.num_addresses
+
+
+def network_from_int(version, start, prefixlen):
+    if instruments.enabled:
+        instruments.count("ipaddress.built")
+    if version == 4:
+        return ipaddress.IPv4Network((start, prefixlen))
+    return ipaddress.IPv6Network((start, prefixlen))
+
+
+class Subnet:
+    # One allocation as a compact record: the label is interned and the
+    # network kept as integers, so the ipaddress object is only built when
+    # something asks for it
+    __slots__ = ('label', 'version', 'start', 'prefixlen')
+
+    def __init__(self, label, version, start, prefixlen):
+        self.label = sys.intern(label)
+        self.version = version
+        self.start = start
+        self.prefixlen = prefixlen
+
+    def __repr__(self):
+        return f"Subnet({self.label!r}, {self.network})"
+
+    @property
+    def num_addresses(self):
+        return 1 << ((32 if self.version == 4 else 128) - self.prefixlen)
+
+    @property
+    def end(self):
+        return self.start + self.num_addresses - 1
+
+    @property
+    def network(self):
+        return network_from_int(self.version, self.start, self.prefixlen)
+
+    def state(self):
+        return (self.label, self.version, self.start, self.prefixlen)
+
+    def restore(self, state):
+        self.label, self.version, self.start, self.prefixlen = state
+
+
+def subnet_state(label, network):
+    # Record state, as stored in Change deltas, for a label and network
+    return (sys.intern(label), network.version, int(network.network_address), network.prefixlen)
+
+
+def make_subnet(label, network):
+    return Subnet(label, network.version, int(network.network_address), network.prefixlen)
+
+
+def address_column(values=()):
+    # Contiguous unsigned 64-bit column; plans with wider (IPv6) addresses
+    # fall back to a list of Python ints
+    values = list(values)
+    try:
+        return array('Q', values)
+    except OverflowError:
+        return values
+
+
+class AllocationIndex:
+    # Sorted index of non-overlapping allocations, so ordering by start also
+    # orders by end and every query is a single bisect on the starts.
+    # Records own their fields; only the bisected start/end columns are typed arrays.
+    def __init__(self):
+        self._starts = address_column()
+        self._ends = address_column()
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def items(self):
+        # Items in address order; callers must not modify the returned list
+        return self._items
+
+    def entries(self):
+        # (start, end, item) in address order, read from the columns
+        return zip(self._starts, self._ends, self._items)
+
+    def find_overlap(self, start, end, ignore=None):
+        # Every allocation left of i starts at or before `end`; only the last
+        # one (or the one before it, if the last is ignored) can reach `start`
+        i = bisect.bisect_right(self._starts, end)
+        for j in (i - 1, i - 2):
+            if j < 0:
+                break
+            if self._items[j] is ignore:
+                continue
+            if self._ends[j] >= start:
+                return self._items[j]
+            break
+        return None
+
+    def find_containing(self, address):
+        i = bisect.bisect_right(self._starts, address) - 1
+        if i >= 0 and self._ends[i] >= address:
+            return self._items[i]
+        return None
+
+    def position(self, start, item):
+        i = bisect.bisect_left(self._starts, start)
+        if i < len(self._items) and self._items[i] is item:
+            return i
+        raise KeyError("Allocation is not in the index")
+
+    def insert(self, start, end, item):
+        conflict = self.find_overlap(start, end)
+        if conflict is not None:
+            raise ValueError(f"Subnet overlaps with existing subnet: {conflict.label}")
+
+        i = bisect.bisect_left(self._starts, start)
+        try:
+            self._starts.insert(i, start)
+        except OverflowError:
+            self._starts = list(self._starts)
+            self._starts.insert(i, start)
+        try:
+            self._ends.insert(i, end)
+        except OverflowError:
+            self._ends = list(self._ends)
+            self._ends.insert(i, end)
+        self._items.insert(i, item)
+        return i
+
+    def remove(self, start, item):
+        i = self.position(start, item)
+        del self._starts[i]
+        del self._ends[i]
+        del self._items[i]
+        return i
+
+    def clear(self):
+        self._starts = address_column()
+        self._ends = address_column()
+        self._items = []
+
+    def load(self, entries, presorted=False):
+        # Bulk load (start, end, item) tuples with a single sort and one
+        # linear overlap pass instead of inserting row by row
+        entries = list(entries)
+        if not presorted:
+            with instruments.timer("index.sort"):
+                entries.sort(key=lambda entry: entry[0])
+
+        with instruments.timer("index.overlap_pass"):
+            for previous, current in zip(entries, entries[1:]):
+                if current[0] <= previous[1]:
+                    raise ValueError(
+                        f"Subnet {current[2].label} overlaps with existing subnet: {previous[2].label}"
+                    )
+
+        self._starts = address_column(entry[0] for entry in entries)
+        self._ends = address_column(entry[1] for entry in entries)
+        self._items = [entry[2] for entry in entries]
+
+    def load_columns(self, starts, ends, items):
+        # Bulk load parallel columns that are already in start order
+        with instruments.timer("index.overlap_pass"):
+            for i in range(1, len(starts)):
+                if starts[i] <= ends[i - 1]:
+                    raise ValueError(f"Subnet {items[i].label} overlaps with existing subnet: {items[i - 1].label}")
+
+        self._starts = address_column(starts)
+        self._ends = address_column(ends)
+        self._items = list(items)
+
+
+class Change:
+    # One operation as a list of (subnet, before, after) deltas, where
+    # before and after are Subnet.state() tuples or None when the subnet is
+    # absent.
+    # Only the subnets an operation touched are recorded, so applying or
+    # inverting a change costs O(k) index updates for k touched subnets.
+    def __init__(self, description, deltas):
+        self.description = description
+        self.deltas = deltas
+
+    def inverted(self):
+        return Change(self.description, [(subnet, after, before) for subnet, before, after in reversed(self.deltas)])
+
+    def subnets(self):
+        return [delta[0] for delta in self.deltas]
+
+
+class Optimization:
+    # An optimized layout computed for one plan version, not yet applied
+    def __init__(self, version, deltas, allocator):
+        self.version = version
+        self.deltas = deltas
+        self.allocator = allocator
+
+
+class SubnetPlan:
+    # A summary network and the subnets allocated inside it, with no UI.
+    # Every mutation goes through apply() as a Change, which feeds undo/redo
+    # and tells listeners exactly which subnets moved.
+    def __init__(self, summary=None):
+        self._summary = summary
+        self._free_space = None
+        self.allocations = AllocationIndex()
+        self.undo_stack = []
+        self.redo_stack = []
+        # Called with the applied Change, or None when the whole plan changed
+        self.listeners = []
+        # Called with a Change before it is applied; a guard refuses it by
+        # raising ValueError, which leaves the plan untouched
+        self.guards = []
+        # Bumped on every change so cached views can tell they are stale
+        self.version = 0
+
+    @property
+    def subnets(self):
+        return self.allocations.items()
+
+    def entries(self):
+        # (start, end, subnet) for every subnet in address order
+        return self.allocations.entries()
+
+    @property
+    def summary(self):
+        return self._summary
+
+    @summary.setter
+    def summary(self, summary):
+        if summary != self._summary:
+            self._summary = summary
+            self._free_space = None
+            self.version += 1
+
+    def set_summary(self, text):
+        self.summary = parse_network(text)
+        return self.summary
+
+    def free_space(self):
+        # Free-space index of the summary, built from the gaps on first use
+        # and then kept in step with every insert and remove
+        if self._free_space is None:
+            self._free_space = self.build_free_space()
+        return self._free_space
+
+    @property
+    def has_free_space(self):
+        # Whether free_space() is ready without a walk over the plan
+        return self._free_space is not None
+
+    @instruments.timed("free_space.build")
+    def build_free_space(self, progress=None):
+        # A fresh free-space index, without installing it. It can be built
+        # on a worker thread and handed to adopt_free_space() afterwards.
+        # `progress(gaps)` is called every PROGRESS_CHUNK_SIZE gaps.
+        free_space = BuddyAllocator(self.summary.max_prefixlen)
+        for i, (first, last) in enumerate(self.gaps()):
+            if progress is not None and i % PROGRESS_CHUNK_SIZE == 0:
+                progress(i)
+            free_space.add_range(first, last)
+        return free_space
+
+    def adopt_free_space(self, free_space, version):
+        # Install an index built by build_free_space() for `version`
+        if version != self.version:
+            return False
+        self._free_space = free_space
+        return True
+
+    def _insert(self, subnet):
+        self.allocations.insert(subnet.start, subnet.end, subnet)
+        if self._free_space is not None and self.covers(subnet):
+            self._free_space.reserve(subnet.start, subnet.prefixlen)
+
+    def _remove(self, subnet):
+        self.allocations.remove(subnet.start, subnet)
+        if self._free_space is not None and self.covers(subnet):
+            self._free_space.add_free(subnet.start, subnet.prefixlen)
+
+    def _apply_deltas(self, deltas):
+        # Remove every touched subnet first so moves within one change can
+        # never collide with each other half way through
+        if len(deltas) > BULK_APPLY_THRESHOLD:
+            touched = {id(subnet) for subnet, _, _ in deltas}
+            subnets = [subnet for subnet in self.subnets if id(subnet) not in touched]
+            free_space = self._free_space
+            if len(deltas) > FREE_SPACE_REBUILD_FRACTION * len(self.allocations):
+                free_space = self._free_space = None
+
+            if free_space is not None:
+                for subnet, before, _ in deltas:
+                    if before is not None and self.covers(subnet):
+                        free_space.add_free(subnet.start, subnet.prefixlen)
+            for subnet, _, after in deltas:
+                if after is not None:
+                    subnet.restore(after)
+                    subnets.append(subnet)
+                    if free_space is not None and self.covers(subnet):
+                        free_space.reserve(subnet.start, subnet.prefixlen)
+            self.allocations.load([(subnet.start, subnet.end, subnet) for subnet in subnets])
+            return
+
+        for subnet, before, _ in deltas:
+            if before is not None:
+                self._remove(subnet)
+        for subnet, _, after in deltas:
+            if after is not None:
+                subnet.restore(after)
+                self._insert(subnet)
+
+    def _notify(self, change):
+        self.version += 1
+        for listener in self.listeners:
+            listener(change)
+
+    def check(self, change):
+        for guard in self.guards:
+            guard(change)
+
+    def apply(self, change):
+        # Apply a validated change and record it for undo
+        self.check(change)
+        self._apply_deltas(change.deltas)
+        self.undo_stack.append(change)
+        del self.undo_stack[:-HISTORY_LIMIT]
+        self.redo_stack.clear()
+        self._notify(change)
+        return change
+
+    def undo(self):
+        if not self.undo_stack:
+            return None
+        inverse = self.undo_stack[-1].inverted()
+        self.check(inverse)
+        change = self.undo_stack.pop()
+        self._apply_deltas(inverse.deltas)
+        self.redo_stack.append(change)
+        self._notify(inverse)
+        return inverse
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        self.check(self.redo_stack[-1])
+        change = self.redo_stack.pop()
+        self._apply_deltas(change.deltas)
+        self.undo_stack.append(change)
+        self._notify(change)
+        return change
+
+    def address(self, value):
+        # Integer to address object of the summary's IP version
+        return type(self.summary.network_address)(value)
+
+    def contains(self, network):
+        return (
+            self.summary is not None
+            and network.version == self.summary.version
+            and self.summary.supernet_of(network)
+        )
+
+    def covers(self, subnet):
+        # contains() for a record, on integers only
+        summary = self.summary
+        return (
+            summary is not None
+            and subnet.version == summary.version
+            and int(summary.network_address) <= subnet.start
+            and subnet.end <= int(summary.broadcast_address)
+        )
+
+    def fits(self, network):
+        # Whether every subnet would lie inside `network` as the summary;
+        # subnets are sorted and disjoint, so the first and last decide it
+        subnets = self.subnets
+        if not subnets:
+            return True
+        start, end = network_bounds(network)
+        return (
+            all(subnet.version == network.version for subnet in (subnets[0], subnets[-1]))
+            and start <= subnets[0].start
+            and subnets[-1].end <= end
+        )
+
+    def covering_network(self):
+        # Smallest network holding every subnet, or None for an empty plan
+        subnets = self.subnets
+        if not subnets:
+            return None
+        first, last = subnets[0], subnets[-1]
+        host_bits = (first.start ^ last.end).bit_length()
+        max_prefixlen = 32 if first.version == 4 else 128
+        return network_from_int(first.version, first.start >> host_bits << host_bits, max_prefixlen - host_bits)
+
+    def find_overlap(self, network, ignore=None):
+        if instruments.enabled:
+            instruments.count("overlap.checks")
+        start, end = network_bounds(network)
+        return self.allocations.find_overlap(start, end, ignore=ignore)
+
+    def add_subnet(self, label, network):
+        if not self.contains(network):
+            raise ValueError("Subnet is not within the summary address range.")
+
+        existing_subnet = self.find_overlap(network)
+        if existing_subnet is not None:
+            raise ValueError(f"Subnet overlaps with existing subnet: {existing_subnet.label}")
+
+        subnet = make_subnet(label, network)
+        self.apply(Change("Add subnet", [(subnet, None, subnet.state())]))
+        return subnet
+
+    def find_free(self, prefixlen, strategy="first"):
+        # Next free /prefixlen in the summary without allocating it
+        if self.summary is None or not self.summary.prefixlen <= prefixlen <= self.summary.max_prefixlen:
+            return None
+        found = self.free_space().find(prefixlen, strategy)
+        if found is None:
+            return None
+        return network_from_int(self.summary.version, found[0], prefixlen)
+
+    def allocate(self, label, prefixlen, strategy="first"):
+        network = self.find_free(prefixlen, strategy)
+        if network is None:
+            raise ValueError(f"No free /{prefixlen} block in the summary address range.")
+        return self.add_subnet(label, network)
+
+    def free_networks(self, prefixlen):
+        # Every free /prefixlen in the summary, in address order
+        if self.summary is None or not self.summary.prefixlen <= prefixlen <= self.summary.max_prefixlen:
+            return
+        for start in self.free_space().iter_fitting(prefixlen):
+            yield network_from_int(self.summary.version, start, prefixlen)
+
+    def update_subnet(self, subnet, label, network):
+        if not self.contains(network):
+            raise ValueError("Subnet is not within the summary address range.")
+
+        existing_subnet = self.find_overlap(network, ignore=subnet)
+        if existing_subnet is not None:
+            raise ValueError(f"Subnet overlaps with existing subnet: {existing_subnet.label}")
+
+        self.apply(Change("Edit subnet", [(subnet, subnet.state(), subnet_state(label, network))]))
+
+    def relocate_subnet(self, subnet, new_network, description="Move subnet"):
+        # Move a subnet to a new network, leaving it untouched on overlap or
+        # when the new network leaves the summary; a guard that refuses the
+        # move raises ValueError
+        if not self.contains(new_network) or self.find_overlap(new_network, ignore=subnet) is not None:
+            return False
+
+        self.apply(Change(description, [(subnet, subnet.state(), subnet_state(subnet.label, new_network))]))
+        return True
+
+    def can_relocate(self, subnet, new_network):
+        # Whether relocate_subnet() would move the subnet, for previews
+        if not self.contains(new_network) or self.find_overlap(new_network, ignore=subnet) is not None:
+            return False
+        try:
+            self.check(Change("Move subnet", [(subnet, subnet.state(), subnet_state(subnet.label, new_network))]))
+        except ValueError:
+            return False
+        return True
+
+    def load(self, subnets, presorted=False):
+        # Replace all subnets with a single sort and overlap pass
+        entries = []
+        for subnet in subnets:
+            entries.append((subnet.start, subnet.end, subnet))
+        self.allocations.load(entries, presorted=presorted)
+        self._loaded()
+
+    def load_columns(self, starts, ends, subnets):
+        # Replace all subnets from address-ordered columns, such as those
+        # read from a snapshot, without building per-subnet entries
+        self.allocations.load_columns(starts, ends, subnets)
+        self._loaded()
+
+    def _loaded(self):
+        self._free_space = None
+
+        # A freshly loaded plan starts a new history
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._notify(None)
+
+    def validate(self):
+        # Overlaps are rejected on load, so only containment is left to check
+        if self.summary is None:
+            return ["No summary address set."]
+        return [
+            f"Subnet {subnet.label} ({subnet.network}) is not within the summary address range."
+            for subnet in self.subnets
+            if not self.covers(subnet)
+        ]
+
+    def optimize(self, minimize_moves=False, progress=None):
+        return self.apply_optimization(self.plan_optimization(minimize_moves, progress))
+
+    @instruments.timed("optimize.plan")
+    def plan_optimization(self, minimize_moves=False, progress=None):
+        # Repack subnets with a buddy allocator so every placement is aligned
+        # and non-overlapping. With minimize_moves, subnets that already sit
+        # inside the region a full repack would use keep their place and
+        # only the rest are moved into the remaining free blocks.
+        # Nothing is applied here and only a copy of the subnet list is read,
+        # so this can run off the UI thread; apply_optimization() applies the
+        # result if the plan has not changed since. `progress(placed)` is
+        # called every PROGRESS_CHUNK_SIZE placements.
+        version = self.version
+        summary = self.summary
+        subnets = list(self.subnets)
+        if not subnets or summary is None:
+            raise ValueError("No subnets to optimize or no summary address set.")
+
+        summary_start, _ = network_bounds(summary)
+        allocator = BuddyAllocator(summary.max_prefixlen)
+        allocator.add_free(summary_start, summary.prefixlen)
+
+        placements = []
+        pending = []
+        if minimize_moves:
+            packed_end = summary_start + sum(subnet.num_addresses for subnet in subnets)
+            for subnet in subnets:
+                if self.covers(subnet) and subnet.end < packed_end and allocator.reserve(subnet.start, subnet.prefixlen):
+                    placements.append((subnet, subnet.start))
+                else:
+                    pending.append(subnet)
+        else:
+            pending = subnets
+
+        # Largest first, so smaller blocks fill the buddies left by splits
+        pending.sort(key=lambda x: x.prefixlen)
+        for i, subnet in enumerate(pending):
+            if progress is not None and i % PROGRESS_CHUNK_SIZE == 0:
+                progress(len(placements))
+            start = None
+            if subnet.version == summary.version:
+                start = allocator.allocate(subnet.prefixlen)
+            if start is None:
+                raise ValueError("Not enough space to optimize subnets")
+            placements.append((subnet, start))
+
+        # Only subnets that actually moved go into the change
+        deltas = [
+            (subnet, subnet.state(), (subnet.label, subnet.version, start, subnet.prefixlen))
+            for subnet, start in placements
+            if subnet.start != start
+        ]
+        return Optimization(version, deltas, allocator)
+
+    @instruments.timed("optimize.apply")
+    def apply_optimization(self, optimization):
+        # Apply a planned optimization as one change, all or nothing
+        if optimization.version != self.version:
+            raise ValueError("The plan changed while it was being optimized. Optimize again.")
+
+        if optimization.deltas:
+            self.apply(Change("Optimize subnets", optimization.deltas))
+
+        # What the allocator left free is exactly the new free space
+        self._free_space = optimization.allocator
+        return optimization.allocator.report(len(optimization.deltas))
+
+    def segments(self):
+        # Subnets and the free ranges between them, in address order:
+        # ('gap', first, last) with integer addresses, or ('subnet', subnet)
+        current, last = network_bounds(self.summary)
+        for subnet in self.subnets:
+            if current < subnet.start:
+                yield ('gap', current, subnet.start - 1)
+            yield ('subnet', subnet)
+            current = subnet.end + 1
+        if current <= last:
+            yield ('gap', current, last)
+
+    def gaps(self):
+        return [(segment[1], segment[2]) for segment in self.segments() if segment[0] == 'gap']
+
+
+class Document:
+    # Plans nested by summary: a plan whose summary lies inside another
+    # plan's summary is its child, e.g. region /12 -> site /16 -> VLAN /24.
+    # Each plan holds only its own level, and the summaries sit in a prefix
+    # trie, so finding the plan for a network follows one trie path instead
+    # of scanning every subnet. When a subnet that is itself a summary moves,
+    # the plans nested under it move with it; a change that would leave a
+    # nested plan's blocks outside its subnet is refused, so the parent's
+    # free space never hands them out again.
+    def __init__(self, plans=()):
+        self._trie = PrefixTrie()
+        for plan in plans:
+            self.add_plan(plan)
+
+    def __len__(self):
+        return len(self._trie)
+
+    def __iter__(self):
+        # Plans in address order, each before the plans nested in it
+        return iter(self._trie)
+
+    @property
+    def plans(self):
+        return list(self._trie)
+
+    @staticmethod
+    def _key(network):
+        return network.version, int(network.network_address), network.prefixlen
+
+    def add_plan(self, plan):
+        if plan.summary is None:
+            raise ValueError("A plan needs a summary address to join a document.")
+        if self.get(plan.summary) is not None:
+            raise ValueError(f"Summary {plan.summary} is already in the document.")
+        self._check_nesting(plan, plan.summary)
+        self._trie.insert(*self._key(plan.summary), plan)
+        plan.listeners.append(self._on_plan_change)
+        plan.guards.append(self._check_change)
+
+    def remove_plan(self, plan):
+        self._trie.remove(*self._key(plan.summary))
+        plan.listeners.remove(self._on_plan_change)
+        plan.guards.remove(self._check_change)
+
+    def retarget(self, plan, summary):
+        # Change a plan's summary, adding the plan if it is not in yet
+        if self.get(summary) not in (None, plan):
+            raise ValueError(f"Summary {summary} is already in the document.")
+        joined = plan.summary is not None and self.get(plan.summary) is plan
+        if joined:
+            self._trie.remove(*self._key(plan.summary))
+        try:
+            self._check_nesting(plan, summary)
+        except ValueError:
+            if joined:
+                self._trie.insert(*self._key(plan.summary), plan)
+            raise
+        if not joined:
+            plan.listeners.append(self._on_plan_change)
+            plan.guards.append(self._check_change)
+        plan.summary = summary
+        self._trie.insert(*self._key(summary), plan)
+
+    def get(self, summary):
+        return self._trie.get(*self._key(summary))
+
+    def plan_for(self, network):
+        # Innermost plan whose summary holds the network, or None. A network
+        # that is itself a summary belongs to the plan around it, if any.
+        key = self._key(network)
+        return self._trie.longest_match(*key, strict=True) or self._trie.longest_match(*key)
+
+    def parent(self, plan):
+        return self._trie.longest_match(*self._key(plan.summary), strict=True)
+
+    def children(self, plan):
+        return self._trie.children(*self._key(plan.summary))
+
+    def subtree(self, plan):
+        # The plan and every plan nested under it, parents first
+        return self._trie.subtree(*self._key(plan.summary))
+
+    def depth(self, plan):
+        return len(self._trie.ancestors(*self._key(plan.summary)))
+
+    def nested_plan(self, subnet):
+        # Plan drilled into a subnet, or None
+        return self._trie.get(subnet.version, subnet.start, subnet.prefixlen)
+
+    def drill_down(self, subnet):
+        # Plan for the blocks inside a subnet, created on first use
+        plan = self.nested_plan(subnet)
+        if plan is None:
+            plan = SubnetPlan(subnet.network)
+            self.add_plan(plan)
+        return plan
+
+    def add_subnet(self, label, network):
+        plan = self.plan_for(network)
+        if plan is None:
+            raise ValueError("Subnet is not within any summary address range.")
+        return plan.add_subnet(label, network)
+
+    def nested_subnet(self, summary):
+        # The subnet a nested summary is drilled down from: the block of the
+        # plan around it with exactly that network. None for a summary that
+        # is not nested; ValueError when the plan around it has no such
+        # subnet, since its free space would hand the summary out again.
+        parent = self._trie.longest_match(*self._key(summary), strict=True)
+        if parent is None:
+            return None
+        return self._backing_subnet(parent, summary)
+
+    @staticmethod
+    def _backing_subnet(parent, summary):
+        subnet = parent.find_overlap(summary)
+        if subnet is None or (subnet.start, subnet.prefixlen) != (int(summary.network_address), summary.prefixlen):
+            raise ValueError(f"{summary} is inside {parent.summary}; add it there as a subnet and drill down into it.")
+        return subnet
+
+    def _check_nesting(self, plan, summary):
+        # A plan joining at a summary needs a subnet of exactly that network
+        # in the plan around it, and needs one itself for every plan already
+        # nested directly inside the summary
+        self.nested_subnet(summary)
+        for child in self._trie.children(*self._key(summary)):
+            self._backing_subnet(plan, child.summary)
+
+    def _check_change(self, change):
+        # A subnet with a plan nested under it may move as a whole. It may
+        # be resized only while the nested blocks still fit, and removed
+        # only while nothing is allocated under it; an empty nested plan is
+        # dropped with it.
+        for subnet, before, after in change.deltas:
+            if before is None or (after is not None and before[3] == after[3]):
+                continue
+            nested = self._trie.get(*before[1:])
+            if nested is None:
+                continue
+            if after is None:
+                if any(plan.subnets for plan in self._trie.subtree(*before[1:])):
+                    raise ValueError(f"Subnet {before[0]} holds the nested plan {nested.summary}; "
+                                     f"remove the blocks inside it first.")
+            elif not nested.fits(network_from_int(*after[1:])):
+                raise ValueError(f"Subnet {before[0]} holds the nested plan {nested.summary}, "
+                                 f"whose blocks would fall outside {network_from_int(*after[1:])}.")
+
+    def _on_plan_change(self, change):
+        if change is None:
+            return
+
+        # Nested plans under subnets this change moved, resized or removed
+        moves = []
+        dropped = []
+        for subnet, before, after in change.deltas:
+            if before is None or (after is not None and before[1:] == after[1:]):
+                continue
+            nested = self._trie.get(*before[1:])
+            if nested is None:
+                continue
+            if after is None:
+                dropped.extend(self._trie.subtree(*before[1:]))
+            else:
+                moves.append((nested, before, after))
+        for plan in dropped:
+            self.remove_plan(plan)
+        if not moves:
+            return
+
+        # Blocks in one change can trade places, so detach every affected
+        # plan before re-keying any of them. _check_change() has made sure a
+        # resized subnet still holds its nested plan's blocks.
+        retargets = []
+        for nested, before, after in moves:
+            version, start, prefixlen = before[1:]
+            if after[3] == prefixlen:
+                offset = after[2] - start
+                for plan in list(self._trie.subtree(version, start, prefixlen)):
+                    retargets.append((plan, offset, None))
+            else:
+                retargets.append((nested, 0, network_from_int(*after[1:])))
+
+        for plan, offset, new_summary in retargets:
+            self._trie.remove(*self._key(plan.summary))
+        for plan, offset, new_summary in retargets:
+            if new_summary is None:
+                summary = plan.summary
+                new_summary = network_from_int(summary.version, int(summary.network_address) + offset, summary.prefixlen)
+            plan.summary = new_summary
+            if offset:
+                plan.load([Subnet(subnet.label, subnet.version, subnet.start + offset, subnet.prefixlen)
+                           for subnet in plan.subnets], presorted=True)
+            self._trie.insert(*self._key(new_summary), plan)
+
+
+def nesting_errors(plans):
+    # Why each plan with a summary could not join a Document, e.g. a summary
+    # nested in another plan with no subnet there to back it
+    document = Document()
+    errors = []
+    for plan in plans:
+        if plan.summary is None:
+            continue
+        try:
+            document.add_plan(plan)
+        except ValueError as e:
+            errors.append(str(e))
+    for plan in document.plans:
+        document.remove_plan(plan)
+    return errors
+
+
+class ImportResult:
+    def __init__(self, plans, rejected, rows):
+        # One plan per summary in the document, in document order
+        self.plans = plans
+        # (line number, label, subnet text, reason) for every skipped row
+        self.rejected = rejected
+        self.rows = rows
+
+    @property
+    def plan(self):
+        return self.plans[0] if self.plans else SubnetPlan()
+
+
+def is_header_row(row):
+    return row[:2] == CSV_HEADER[:2]
+
+
+@instruments.timed("import.csv")
+def import_csv(csvfile, chunk_size=PROGRESS_CHUNK_SIZE, progress=None):
+    # Streaming import: rows are parsed straight to integers, then sorted
+    # once so overlaps fall out of a single pass over neighbours. Rows that
+    # fail to parse, fall outside every summary or overlap an earlier row
+    # are rejected individually instead of aborting the import.
+    # A document may hold several "Summary" sections (for example an IPv4
+    # and an IPv6 block); each subnet goes to the innermost summary that
+    # contains it, and each summary becomes its own plan. Documents without
+    # a summary get one unbounded plan per IP version.
+    # `progress(consumed)` is called every `chunk_size` rows with the number
+    # of characters read so far.
+    consumed = [0]
+
+    def lines():
+        for line in csvfile:
+            consumed[0] += len(line)
+            yield line
+
+    reader = csv.reader(lines())
+
+    summaries = []
+    records = []
+    rejected = []
+    rows = 0
+    for row in reader:
+        if not row:
+            continue
+
+        line = reader.line_num
+        if row[0] == "Summary":
+            try:
+                summary = parse_network(row[1] if len(row) > 1 else "")
+                if summary not in summaries:
+                    summaries.append(summary)
+            except ValueError as e:
+                rejected.append((line, row[0], row[1] if len(row) > 1 else "", f"Invalid summary: {e}"))
+            continue
+        # Any other row, the first one included, is either accepted or
+        # rejected, so a file without a header loses no data
+        if is_header_row(row):
+            continue
+
+        rows += 1
+        if progress is not None and rows % chunk_size == 0:
+            progress(consumed[0])
+
+        label = row[0]
+        subnet_text = row[1] if len(row) > 1 else ""
+        try:
+            version, start, prefixlen = parse_cidr(subnet_text)
+        except ValueError as e:
+            rejected.append((line, label, subnet_text, f"Invalid subnet: {e}"))
+            continue
+
+        end = start + (1 << ((32 if version == 4 else 128) - prefixlen)) - 1
+        records.append((version, start, end, prefixlen, label, line, subnet_text))
+
+    if progress is not None:
+        progress(consumed[0])
+
+    # Assign every row to a plan, innermost summary first
+    if summaries:
+        plans = [SubnetPlan(summary) for summary in summaries]
+        trie = PrefixTrie()
+        for i, summary in enumerate(summaries):
+            trie.insert(summary.version, int(summary.network_address), summary.prefixlen, i)
+    else:
+        plans = []
+        versions = sorted({record[0] for record in records})
+        plan_by_version = {}
+        for version in versions:
+            plan_by_version[version] = len(plans)
+            plans.append(SubnetPlan())
+
+    members = [[] for _ in plans]
+    for record in records:
+        version, start, prefixlen = record[0], record[1], record[3]
+        if summaries:
+            # A subnet that is itself a nested summary belongs to the summary
+            # around it, so strict containment wins over an equal summary
+            target = trie.longest_match(version, start, prefixlen, strict=True)
+            if target is None:
+                target = trie.longest_match(version, start, prefixlen)
+            if target is None:
+                rejected.append((record[5], record[4], record[6], "Subnet is not within the summary address range."))
+                continue
+        else:
+            target = plan_by_version[version]
+        members[target].append(record)
+
+    # One sort per plan, then one pass comparing each row with the last
+    # accepted one
+    for plan, plan_records in zip(plans, members):
+        plan_records.sort(key=lambda record: (record[1], record[5]))
+        subnets = []
+        last = None
+        for version, start, end, prefixlen, label, line, subnet_text in plan_records:
+            if last is not None and start <= last[2]:
+                rejected.append((line, label, subnet_text, f"Subnet overlaps with existing subnet: {last[4]}"))
+                continue
+            last = (version, start, end, prefixlen, label)
+            subnets.append(Subnet(label, version, start, prefixlen))
+        plan.load(subnets, presorted=True)
+
+    rejected.sort()
+    return ImportResult(plans, rejected, rows)
+
+
+def read_document(csvfile):
+    # Strict import: any rejected row fails the whole file
+    result = import_csv(csvfile)
+    if result.rejected:
+        line, label, subnet_text, reason = result.rejected[0]
+        raise ValueError(f"Line {line} ({label}, {subnet_text}): {reason}")
+    return result.plans
+
+
+def read_csv(csvfile):
+    plans = read_document(csvfile)
+    return plans[0] if plans else SubnetPlan()
+
+
+def write_rejections(rejected, csvfile):
+    writer = csv.writer(csvfile)
+    writer.writerow(REJECTION_HEADER)
+    writer.writerows(rejected)
+
+
+@instruments.timed("export.csv")
+def write_document(plans, csvfile, chunk_size=PROGRESS_CHUNK_SIZE, progress=None):
+    # `progress(written)` is called every `chunk_size` subnets
+    writer = csv.writer(csvfile)
+    written = 0
+    for plan in plans:
+        # Each plan starts with its summary address, then the header row
+        if plan.summary is not None:
+            writer.writerow(["Summary", str(plan.summary)])
+        writer.writerow(CSV_HEADER)
+
+        for subnet in plan.subnets:
+            written += 1
+            if progress is not None and written % chunk_size == 0:
+                progress(written)
+            network = subnet.network
+            writer.writerow([
+                subnet.label,
+                str(network),
+                str(network.network_address),
+                str(network.broadcast_address),
+                host_count(network)
+            ])
+
+
+def write_csv(plan, csvfile):
+    write_document([plan], csvfile)
+
+
+def load_document(filepath):
+    with open(filepath, "r", newline="") as csvfile:
+        return read_document(csvfile)
+
+
+def save_document(plans, filepath):
+    with open(filepath, "w", newline="") as csvfile:
+        write_document(plans, csvfile)
+
+
+def load_plan(filepath):
+    with open(filepath, "r", newline="") as csvfile:
+        return read_csv(csvfile)
+
+
+def save_plan(plan, filepath):
+    save_document([plan], filepath)
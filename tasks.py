@@ -0,0 +1,56 @@
+import queue
+import threading
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Task:
+    # Runs work(progress, *args) on a daemon thread. The worker only talks
+    # to its owner through a queue, so a Tk callback can drain it from
+    # after() without any widget being touched off the UI thread.
+    # progress(value) queues a progress message and is also the worker's
+    # cancellation point: once cancel() is called it raises Cancelled.
+    def __init__(self, work, *args):
+        self.work = work
+        self.args = args
+        self.messages = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def progress(self, value):
+        if self._cancelled.is_set():
+            raise Cancelled()
+        self.messages.put(('progress', value))
+
+    def _run(self):
+        try:
+            result = self.work(self.progress, *self.args)
+        except Cancelled:
+            self.messages.put(('cancelled', None))
+        except Exception as e:
+            self.messages.put(('error', e))
+        else:
+            # A cancel that came after the last checkpoint still wins
+            self.messages.put(('cancelled', None) if self.cancelled else ('done', result))
+
+    def poll(self):
+        # Every queued (kind, payload) message, oldest first, without waiting
+        drained = []
+        while True:
+            try:
+                drained.append(self.messages.get_nowait())
+            except queue.Empty:
+                return drained
@@ -0,0 +1,19 @@
+import os
+import sys
+
+# The engine modules sit at the top of the repository, next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subnet_engine import SubnetPlan, parse_network  # noqa: E402
+
+
+def plan_with(summary, *subnets):
+    plan = SubnetPlan(parse_network(summary))
+    for label, network in subnets:
+        plan.add_subnet(label, parse_network(network))
+    return plan
+
+
+def rows(plan):
+    # (label, network text) of every subnet, in address order
+    return [(subnet.label, str(subnet.network)) for subnet in plan.subnets]
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from conftest import plan_with, rows
+from subnet_engine import AllocationIndex, parse_network
+
+
+class Item:
+    def __init__(self, label):
+        self.label = label
+
+
+def test_queries_match_a_scan():
+    rng = random.Random(1)
+    index = AllocationIndex()
+    blocks = []
+    for i in range(300):
+        start = rng.randrange(1 << 20)
+        end = start + rng.randrange(1, 64)
+        item = Item(str(i))
+        try:
+            index.insert(start, end, item)
+        except ValueError:
+            assert any(start <= other_end and other_start <= end for other_start, other_end, _ in blocks)
+            continue
+        blocks.append((start, end, item))
+
+    assert [item for _, _, item in sorted(blocks, key=lambda block: block[0])] == list(index)
+    for _ in range(300):
+        address = rng.randrange(1 << 20)
+        holder = next((item for start, end, item in blocks if start <= address <= end), None)
+        assert index.find_containing(address) is holder
+        assert (index.find_overlap(address, address + 10) is None) == \
+            all(end < address or address + 10 < start for start, end, _ in blocks)
+
+    start, end, item = blocks[0]
+    index.remove(start, item)
+    assert index.find_containing(start) is None
+    assert len(index) == len(blocks) - 1
+
+
+def test_bulk_load_rejects_overlaps():
+    index = AllocationIndex()
+    with pytest.raises(ValueError, match="overlaps"):
+        index.load([(10, 19, Item("a")), (0, 10, Item("b"))])
+    index.load([(10, 19, Item("a")), (0, 9, Item("b"))])
+    assert [item.label for item in index] == ["b", "a"]
+
+
+def test_add_subnet_checks_overlap_and_containment():
+    plan = plan_with("10.0.0.0/24", ("a", "10.0.0.0/26"))
+    with pytest.raises(ValueError, match="overlaps"):
+        plan.add_subnet("b", parse_network("10.0.0.32/27"))
+    with pytest.raises(ValueError, match="not within"):
+        plan.add_subnet("b", parse_network("10.0.1.0/26"))
+    assert rows(plan) == [("a", "10.0.0.0/26")]
@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from allocator import BuddyAllocator
+from conftest import plan_with
+from subnet_engine import Change
+
+
+def free_addresses(allocator):
+    # Every free address, expanded from the free blocks
+    free = set()
+    for start, prefixlen in allocator.free_blocks():
+        free.update(range(start, start + allocator.block_size(prefixlen)))
+    return free
+
+
+def test_allocate_splits_and_free_merges_back():
+    allocator = BuddyAllocator(8)
+    allocator.add_free(0, 0)
+
+    starts = [allocator.allocate(2) for _ in range(4)]
+    assert starts == [0, 64, 128, 192]
+    assert allocator.allocate(2) is None
+    assert allocator.free_addresses == 0
+
+    for start in starts:
+        allocator.add_free(start, 2)
+    assert allocator.free_blocks() == [(0, 0)]
+    assert allocator.free_addresses == 256
+
+
+@pytest.mark.parametrize("first, last", [(0, 255), (3, 200), (17, 17), (128, 255)])
+def test_add_range_covers_exactly_the_range_in_aligned_blocks(first, last):
+    allocator = BuddyAllocator(8)
+    allocator.add_range(first, last)
+
+    assert free_addresses(allocator) == set(range(first, last + 1))
+    for start, prefixlen in allocator.free_blocks():
+        assert start % allocator.block_size(prefixlen) == 0
+
+
+def test_best_fit_prefers_the_smallest_block():
+    allocator = BuddyAllocator(8)
+    allocator.add_free(0, 1)
+    allocator.add_free(192, 3)
+
+    assert allocator.find(4, "best") == (192, 3)
+    assert allocator.find(4, "first") == (0, 1)
+
+
+def test_reserve_only_takes_free_blocks():
+    allocator = BuddyAllocator(8)
+    allocator.add_free(0, 0)
+
+    assert allocator.reserve(40, 5)
+    assert not allocator.reserve(40, 5)
+    assert free_addresses(allocator) == set(range(256)) - set(range(40, 48))
+
+
+def test_random_operations_match_a_set_of_addresses():
+    rng = random.Random(4)
+    allocator = BuddyAllocator(10)
+    allocator.add_free(0, 0)
+    expected = set(range(1024))
+    taken = []
+
+    for _ in range(500):
+        if taken and rng.random() < 0.4:
+            start, prefixlen = taken.pop(rng.randrange(len(taken)))
+            allocator.add_free(start, prefixlen)
+            expected.update(range(start, start + allocator.block_size(prefixlen)))
+        else:
+            prefixlen = rng.randint(3, 10)
+            start = allocator.allocate(prefixlen, rng.choice(["first", "best"]))
+            if start is None:
+                continue
+            block = set(range(start, start + allocator.block_size(prefixlen)))
+            assert block <= expected
+            expected -= block
+            taken.append((start, prefixlen))
+
+        assert allocator.free_addresses == len(expected)
+    assert free_addresses(allocator) == expected
+
+
+def test_report_fragmentation():
+    allocator = BuddyAllocator(8)
+    assert allocator.report().fragmentation == 0.0
+
+    allocator.add_free(0, 1)
+    allocator.add_free(192, 2)
+    report = allocator.report(moves=3)
+    assert report.moves == 3
+    assert report.free_blocks == 2
+    assert report.largest_free_prefixlen == 1
+    assert report.fragmentation == pytest.approx(1 - 128 / 192)
+
+
+@pytest.mark.parametrize("minimize_moves", [False, True])
+def test_optimize_packs_every_subnet(minimize_moves):
+    rng = random.Random(3)
+    plan = plan_with("10.0.0.0/16")
+    for i in range(200):
+        plan.allocate(f"s{i}", rng.randint(22, 28), "best")
+    for subnet in rng.sample(list(plan.subnets), 100):
+        plan.apply(Change("Remove", [(subnet, subnet.state(), None)]))
+    before = sorted((subnet.label, subnet.prefixlen) for subnet in plan.subnets)
+
+    plan.optimize(minimize_moves=minimize_moves)
+    assert sorted((subnet.label, subnet.prefixlen) for subnet in plan.subnets) == before
+    assert plan.validate() == []
+    used = sum(subnet.num_addresses for subnet in plan.subnets)
+    assert plan.subnets[-1].end < int(plan.summary.network_address) + 2 * used
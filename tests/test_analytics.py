@@ -0,0 +1,61 @@
+import json
+import random
+
+import cli
+from analytics import plan_stats
+from conftest import plan_with
+from subnet_engine import Change
+
+
+def test_figures_for_a_small_plan():
+    stats = plan_stats(plan_with("10.0.0.0/24", ("a", "10.0.0.0/26"), ("b", "10.0.0.128/27")))
+    assert (stats.subnets, stats.used_addresses, stats.free_addresses) == (2, 96, 160)
+    assert stats.utilization == 96 / 256
+    assert stats.histogram == {26: 2, 27: 1}
+    assert stats.free_blocks == 3
+    assert str(stats.largest_free) == "10.0.0.64/26"
+    assert stats.fragmentation == 1 - 64 / 160
+
+
+def test_stats_follow_changes_like_a_rescan():
+    rng = random.Random(8)
+    plan = plan_with("10.0.0.0/16")
+    plan_stats(plan)
+    for step in range(300):
+        prefixlen = rng.randint(20, 28)
+        if plan.subnets and (rng.random() < 0.4 or plan.find_free(prefixlen) is None):
+            subnet = rng.choice(plan.subnets)
+            plan.apply(Change("Remove", [(subnet, subnet.state(), None)]))
+        else:
+            plan.allocate(f"s{step}", prefixlen, rng.choice(["first", "best"]))
+
+        stats = plan_stats(plan)
+        gaps = plan.gaps()
+        assert stats.free_addresses == sum(last - first + 1 for first, last in gaps)
+        assert stats.used_addresses == sum(subnet.num_addresses for subnet in plan.subnets)
+        assert stats.histogram == {prefixlen: count for prefixlen, count
+                                   in enumerate(plan.build_free_space().histogram()) if count}
+        if stats.free_addresses:
+            assert stats.fragmentation == 1 - stats.largest_free.num_addresses / stats.free_addresses
+
+
+def test_capacity_counts_blocks_that_still_fit():
+    stats = plan_stats(plan_with("10.0.0.0/24", ("a", "10.0.0.0/26"), ("b", "10.0.0.128/27")))
+    assert stats.capacity(26) == 2
+    assert stats.capacity(27) == 5
+    assert stats.capacity(23) == 0
+    assert stats.capacity(33) == 0
+
+
+def test_cli_stats(tmp_path, capsys):
+    path = tmp_path / "plan.csv"
+    path.write_text("Summary,10.0.0.0/24\na,10.0.0.0/26\nb,10.0.0.128/27\n")
+    assert cli.main(["stats", str(path), "-p", "26"]) == 0
+    out = capsys.readouterr().out
+    assert out.startswith("10.0.0.0/24: 37.5% used by 2 subnets")
+    assert "room for 2 more /26 blocks" in out
+
+    assert cli.main(["stats", str(path), "--json", "-p", "27"]) == 0
+    figures = json.loads(capsys.readouterr().out)
+    assert figures[0]["capacity"] == {"/27": 5}
+    assert figures[0]["free_addresses"] == 160
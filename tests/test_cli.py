@@ -0,0 +1,56 @@
+import cli
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def data_rows(text):
+    # (label, subnet) of every subnet row in CSV output
+    return [tuple(line.split(",")[:2]) for line in text.splitlines()
+            if line and not line.startswith(("Summary,", "Label,"))]
+
+
+PLAN = "Summary,10.0.0.0/24\nLabel,Subnet\nb,10.0.0.128/26\na,10.0.0.64/27\n"
+
+
+def test_validate(tmp_path, capsys):
+    assert cli.main(["validate", write(tmp_path, "ok.csv", PLAN)]) == 0
+    assert "2 subnets OK in 10.0.0.0/24" in capsys.readouterr().out
+
+    bad = write(tmp_path, "bad.csv", PLAN + "c,10.0.0.130/32\nd,10.0.1.0/24\n")
+    rejections = str(tmp_path / "rejected.csv")
+    assert cli.main(["validate", bad, "-r", rejections]) == 1
+    err = capsys.readouterr().err
+    assert "Line 5 (c, 10.0.0.130/32)" in err and "Line 6 (d, 10.0.1.0/24)" in err
+    assert len(open(rejections).read().splitlines()) == 3
+
+
+def test_optimize_writes_the_packed_plan(tmp_path, capsys):
+    output = str(tmp_path / "out.csv")
+    assert cli.main(["optimize", write(tmp_path, "plan.csv", PLAN), "-o", output]) == 0
+    assert data_rows(open(output).read()) == [("b", "10.0.0.0/26"), ("a", "10.0.0.64/27")]
+    assert "1 subnets moved" in capsys.readouterr().err
+
+
+def test_gaps(tmp_path, capsys):
+    assert cli.main(["gaps", write(tmp_path, "plan.csv", PLAN)]) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "Available (10.0.0.0 - 10.0.0.63) 64 addresses",
+        "Available (10.0.0.96 - 10.0.0.127) 32 addresses",
+        "Available (10.0.0.192 - 10.0.0.255) 64 addresses",
+    ]
+
+
+def test_export_normalizes_to_stdout(tmp_path, capsys):
+    assert cli.main(["export", write(tmp_path, "plan.csv", PLAN)]) == 0
+    out = capsys.readouterr().out
+    assert out.splitlines()[0] == "Summary,10.0.0.0/24"
+    assert data_rows(out) == [("a", "10.0.0.64/27"), ("b", "10.0.0.128/26")]
+
+
+def test_errors_exit_with_a_message(tmp_path, capsys):
+    assert cli.main(["gaps", str(tmp_path / "missing.csv")]) == 1
+    assert capsys.readouterr().err.startswith("Error:")
@@ -0,0 +1,108 @@
+import pytest
+
+import cli
+from conftest import plan_with, rows
+from subnet_engine import Change, Document, SubnetPlan, parse_network
+
+
+def nested_document():
+    parent = plan_with("10.0.0.0/16", ("x", "10.0.8.0/22"))
+    document = Document([parent])
+    x = parent.subnets[0]
+    nested = document.drill_down(x)
+    nested.add_subnet("c", parse_network("10.0.10.0/24"))
+    return document, parent, x, nested
+
+
+def test_nested_plan_follows_a_moved_subnet():
+    document, parent, x, nested = nested_document()
+    assert parent.relocate_subnet(x, parse_network("10.0.4.0/22"))
+    assert str(nested.summary) == "10.0.4.0/22"
+    assert rows(nested) == [("c", "10.0.6.0/24")]
+    assert document.nested_plan(x) is nested
+
+    parent.undo()
+    assert str(nested.summary) == "10.0.8.0/22"
+    assert rows(nested) == [("c", "10.0.10.0/24")]
+
+
+def test_resize_that_cuts_off_a_nested_plan_is_refused():
+    document, parent, x, nested = nested_document()
+    with pytest.raises(ValueError, match="nested plan"):
+        parent.update_subnet(x, "x", parse_network("10.0.8.0/23"))
+    assert not parent.can_relocate(x, parse_network("10.0.8.0/23"))
+    assert str(x.network) == "10.0.8.0/22"
+    # The nested block is never handed out again
+    assert not parent.allocate("y", 23, "best").network.overlaps(parse_network("10.0.8.0/22"))
+
+
+def test_resize_that_keeps_the_nested_blocks_is_allowed():
+    document, parent, x, nested = nested_document()
+    parent.update_subnet(x, "x", parse_network("10.0.0.0/20"))
+    assert str(nested.summary) == "10.0.0.0/20"
+    assert rows(nested) == [("c", "10.0.10.0/24")]
+    assert document.nested_plan(x) is nested
+
+
+def test_removing_a_subnet_with_a_nested_plan():
+    document, parent, x, nested = nested_document()
+    with pytest.raises(ValueError, match="nested plan"):
+        parent.apply(Change("Remove", [(x, x.state(), None)]))
+    assert document.nested_plan(x) is nested
+
+    # An empty nested plan goes with its subnet
+    nested.apply(Change("Remove", [(subnet, subnet.state(), None) for subnet in nested.subnets]))
+    parent.apply(Change("Remove", [(x, x.state(), None)]))
+    assert document.get(parse_network("10.0.8.0/22")) is None
+
+
+def test_nested_summary_needs_a_subnet_behind_it():
+    document, parent, x, nested = nested_document()
+    assert document.nested_subnet(parse_network("10.0.8.0/22")) is x
+    assert document.nested_subnet(parse_network("192.168.0.0/16")) is None
+    with pytest.raises(ValueError):
+        document.nested_subnet(parse_network("10.0.1.0/24"))
+
+
+def test_unbacked_nested_summary_cannot_join():
+    parent = plan_with("10.0.0.0/16", ("x", "10.0.4.0/22"))
+    nested = plan_with("10.0.8.0/21", ("c", "10.0.8.0/24"))
+    with pytest.raises(ValueError, match="10.0.8.0/21 is inside 10.0.0.0/16"):
+        Document([parent, nested])
+    # Whichever plan joins first
+    with pytest.raises(ValueError, match="10.0.8.0/21 is inside 10.0.0.0/16"):
+        Document([nested, parent])
+
+    document = Document([parent])
+    with pytest.raises(ValueError):
+        document.retarget(SubnetPlan(), parse_network("10.0.8.0/21"))
+    with pytest.raises(ValueError):
+        document.retarget(nested, parse_network("10.0.4.0/23"))
+    assert document.plans == [parent]
+
+
+def test_cli_refuses_unbacked_nested_summary(tmp_path, capsys):
+    path = tmp_path / "plan.csv"
+    path.write_text("Summary,10.0.0.0/16\nSummary,10.0.8.0/21\nc,10.0.8.0/24\n")
+    assert cli.main(["allocate", str(path), "-p", "21", "-l", "y"]) == 1
+    assert "10.0.8.0/21" not in capsys.readouterr().out
+
+    assert cli.main(["validate", str(path)]) == 1
+    assert "10.0.8.0/21 is inside 10.0.0.0/16" in capsys.readouterr().err
+
+
+def test_cli_tree(tmp_path, capsys):
+    path = tmp_path / "plan.csv"
+    path.write_text("Summary,10.0.0.0/16\nx,10.0.8.0/22\nSummary,10.0.8.0/22\nc,10.0.10.0/24\n"
+                    "Summary,2001:db8::/32\n")
+    assert cli.main(["tree", str(path)]) == 0
+    assert capsys.readouterr().out.splitlines() == ["10.0.0.0/16 1 subnets", "  10.0.8.0/22 1 subnets",
+                                                    "2001:db8::/32 0 subnets"]
+
+
+def test_cli_optimize_moves_nested_summaries(tmp_path, capsys):
+    path = tmp_path / "plan.csv"
+    path.write_text("Summary,10.0.0.0/16\nx,10.0.8.0/22\nSummary,10.0.8.0/22\nc,10.0.10.0/24\n")
+    assert cli.main(["optimize", str(path)]) == 0
+    out = capsys.readouterr().out
+    assert "Summary,10.0.0.0/22" in out and "x,10.0.0.0/22" in out
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+import cli
+from conftest import plan_with
+from subnet_engine import BULK_APPLY_THRESHOLD, Change
+
+
+def test_allocate_first_and_best_fit():
+    plan = plan_with("10.0.0.0/24", ("a", "10.0.0.0/26"), ("b", "10.0.0.128/27"))
+    assert str(plan.allocate("best", 27, "best").network) == "10.0.0.160/27"
+    assert str(plan.allocate("first", 27, "first").network) == "10.0.0.64/27"
+    with pytest.raises(ValueError):
+        plan.allocate("big", 25)
+
+
+def test_free_networks_lists_every_free_block():
+    plan = plan_with("10.0.0.0/24", ("a", "10.0.0.64/26"))
+    assert [str(network) for network in plan.free_networks(26)] == ["10.0.0.0/26", "10.0.0.128/26", "10.0.0.192/26"]
+    assert list(plan.free_networks(23)) == []
+
+
+@pytest.mark.parametrize("count", [50, BULK_APPLY_THRESHOLD * 2])
+def test_free_space_follows_changes(count):
+    # Small changes update the free-space index block by block, bulk ones
+    # through the one-pass path; either way it must match a rebuild
+    rng = random.Random(count)
+    plan = plan_with("10.0.0.0/12")
+    for i in range(count * 2):
+        plan.allocate(f"s{i}", rng.randint(24, 28), rng.choice(["first", "best"]))
+    plan.free_space()
+
+    removed = rng.sample(list(plan.subnets), count)
+    plan.apply(Change("Remove", [(subnet, subnet.state(), None) for subnet in removed]))
+    assert plan.free_space().free_blocks() == plan.build_free_space().free_blocks()
+    plan.undo()
+    assert plan.free_space().free_blocks() == plan.build_free_space().free_blocks()
+
+
+def test_cli_allocate_and_free(tmp_path, capsys):
+    path = tmp_path / "plan.csv"
+    path.write_text("Summary,10.0.0.0/24\nLabel,Subnet\na,10.0.0.0/26\n")
+    output = str(tmp_path / "out.csv")
+
+    assert cli.main(["allocate", str(path), "-p", "26", "-n", "2", "-l", "web", "-o", output]) == 0
+    assert capsys.readouterr().err.splitlines() == ["web1,10.0.0.64/26", "web2,10.0.0.128/26"]
+    assert cli.main(["free", output, "-p", "26"]) == 0
+    assert capsys.readouterr().out.splitlines() == ["10.0.0.192/26"]
+    assert cli.main(["allocate", output, "-p", "25"]) == 1
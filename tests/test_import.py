@@ -0,0 +1,81 @@
+import io
+import ipaddress
+
+import pytest
+
+from conftest import plan_with, rows
+from subnet_engine import import_csv, parse_cidr, read_document, write_document
+
+
+@pytest.mark.parametrize("text", ["10.0.0.0/8", "10.1.2.3/24", "10.0.0.1", " 192.168.1.0/24 ", "10.0.0.0/08",
+                                  "10.0.0.0/255.0.0.0", "2001:db8::/32", "::1"])
+def test_parse_cidr_matches_ip_network(text):
+    network = ipaddress.ip_network(text.strip(), strict=False)
+    assert parse_cidr(text) == (network.version, int(network.network_address), network.prefixlen)
+
+
+@pytest.mark.parametrize("text", ["10.0.0.0/", "10.0.0.0/33", "256.0.0.0/8", "01.0.0.0/8", "10.0.0/8", "10.0.0.0/+8",
+                                  "١.0.0.0/8", "10.0.0.0/٨", "", "label"])
+def test_parse_cidr_rejects_what_ip_network_rejects(text):
+    with pytest.raises(ValueError):
+        parse_cidr(text)
+
+
+def test_import_rejects_bad_rows_and_keeps_the_rest():
+    csvfile = io.StringIO(
+        "Summary,10.0.0.0/16\n"
+        "Label,Subnet\n"
+        "a,10.0.0.0/24\n"
+        "bad,10.0.0.0/\n"
+        "outside,10.1.0.0/24\n"
+        "overlap,10.0.0.128/25\n"
+        "b,10.0.1.0/24\n"
+    )
+    result = import_csv(csvfile)
+    assert rows(result.plan) == [("a", "10.0.0.0/24"), ("b", "10.0.1.0/24")]
+    assert result.rows == 5
+    assert [(line, label) for line, label, _, _ in result.rejected] == [(4, "bad"), (5, "outside"), (6, "overlap")]
+
+
+def test_import_without_header_keeps_the_first_row():
+    result = import_csv(io.StringIO("a,10.0.0.0/24\nb,10.0.1.0/24\n"))
+    assert rows(result.plan) == [("a", "10.0.0.0/24"), ("b", "10.0.1.0/24")]
+    assert result.rows == 2
+    assert result.rejected == []
+
+
+def test_import_reports_progress():
+    text = "".join(f"s{i},10.0.{i}.0/24\n" for i in range(250))
+    seen = []
+    import_csv(io.StringIO(text), chunk_size=100, progress=seen.append)
+    assert seen == sorted(seen) and seen[-1] == len(text)
+
+
+def test_document_round_trip_keeps_every_summary():
+    plans = [plan_with("10.0.0.0/16", ("a", "10.0.8.0/22")),
+             plan_with("10.0.8.0/22", ("b", "10.0.10.0/24")),
+             plan_with("2001:db8::/32", ("c", "2001:db8:1::/48"))]
+    csvfile = io.StringIO()
+    write_document(plans, csvfile)
+    csvfile.seek(0)
+
+    loaded = read_document(csvfile)
+    assert [plan.summary for plan in loaded] == [plan.summary for plan in plans]
+    assert [rows(plan) for plan in loaded] == [rows(plan) for plan in plans]
+
+
+def test_import_without_summary_splits_by_ip_version():
+    result = import_csv(io.StringIO("a,10.0.0.0/24\nb,2001:db8::/64\nc,10.0.1.0/24\n"))
+    assert [rows(plan) for plan in result.plans] == [[("a", "10.0.0.0/24"), ("c", "10.0.1.0/24")],
+                                                     [("b", "2001:db8::/64")]]
+
+
+def test_import_assigns_rows_to_the_innermost_summary():
+    result = import_csv(io.StringIO("Summary,10.0.8.0/22\nb,10.0.10.0/24\nSummary,10.0.0.0/16\n"
+                                    "a,10.0.8.0/22\nc,10.0.0.0/24\nSummary,10.0.10.0/24\nd,10.0.10.128/25\n"
+                                    "e,192.168.0.0/24\n"))
+    assert [rows(plan) for plan in result.plans] == [[("b", "10.0.10.0/24")],
+                                                     [("c", "10.0.0.0/24"), ("a", "10.0.8.0/22")],
+                                                     [("d", "10.0.10.128/25")]]
+    assert [reason for line, label, subnet_text, reason in result.rejected] == [
+        "Subnet is not within the summary address range."]
@@ -0,0 +1,59 @@
+import io
+import json
+
+import cli
+from instrumentation import NULL_TIMER, Instruments, instruments
+
+
+def test_disabled_instruments_record_nothing():
+    recorder = Instruments()
+    assert recorder.timer("parse") is NULL_TIMER
+
+    @recorder.timed("work")
+    def work(value):
+        return value * 2
+
+    with recorder.timer("parse"):
+        pass
+    assert work(2) == 4
+    assert recorder.snapshot()['timings'] == {}
+
+
+def test_timers_counters_and_dump():
+    recorder = Instruments(enabled=True)
+
+    @recorder.timed("work")
+    def work():
+        return "done"
+
+    assert work() == "done"
+    with recorder.timer("work"):
+        pass
+    recorder.count("rows", 3)
+    recorder.count("rows")
+
+    snapshot = recorder.snapshot()
+    assert snapshot['timings']['work']['count'] == 2
+    assert snapshot['counters'] == {'rows': 4}
+    assert [event['name'] for event in snapshot['events']] == ["work", "work"]
+    assert recorder.summary_lines()[-1] == "rows: 4"
+
+    f = io.StringIO()
+    recorder.dump(f)
+    assert json.loads(f.getvalue())['counters'] == {'rows': 4}
+
+    recorder.reset()
+    assert recorder.snapshot()['timings'] == {}
+
+
+def test_cli_profile_writes_timings(tmp_path, monkeypatch):
+    monkeypatch.setattr(instruments, "enabled", False)
+    instruments.reset()
+    path = tmp_path / "plan.csv"
+    path.write_text("Summary,10.0.0.0/24\na,10.0.0.64/26\n")
+    profile = tmp_path / "profile.json"
+
+    assert cli.main(["--profile", str(profile), "optimize", str(path), "-o", str(tmp_path / "out.csv")]) == 0
+    report = json.loads(profile.read_text())
+    assert {"import.csv", "optimize.plan", "export.csv"} <= set(report['timings'])
+    assert report['counters']['ipaddress.parsed'] >= 1
@@ -0,0 +1,94 @@
+import random
+
+from conftest import plan_with
+from layout import Layout, MIN_SUBNET_HEIGHT, ROW_SPACING
+
+
+def random_plan(seed, count=300):
+    rng = random.Random(seed)
+    plan = plan_with("10.0.0.0/12")
+    for i in range(count):
+        plan.allocate(f"s{i}", rng.randint(20, 28), rng.choice(["first", "best"]))
+    return plan
+
+
+def test_rows_follow_the_plan_in_order():
+    plan = random_plan(1)
+    layout = Layout(plan, 800, "linear")
+    assert layout.segments == list(plan.segments())
+    for i in range(1, len(layout)):
+        assert layout.tops[i] == layout.tops[i - 1] + layout.heights[i - 1] + ROW_SPACING
+    assert all(height >= MIN_SUBNET_HEIGHT for segment, height in zip(layout.segments, layout.heights)
+               if segment[0] == 'subnet')
+
+
+def test_visible_rows_match_a_scan():
+    layout = Layout(random_plan(2), 800, "linear")
+    rng = random.Random(2)
+    for _ in range(200):
+        top = rng.uniform(0, layout.height)
+        bottom = top + rng.uniform(0, 1000)
+        expected = [i for i in range(len(layout))
+                    if layout.tops[i] < bottom and layout.tops[i] + layout.heights[i] >= top]
+        visible = list(layout.visible_rows(top, bottom))
+        # The window may take one extra row at the top edge, never miss one
+        assert set(expected) <= set(visible)
+        assert len(visible) <= len(expected) + 1
+
+
+def test_row_at_finds_the_row_under_a_point():
+    layout = Layout(random_plan(3), 800, "linear")
+    for i in range(len(layout)):
+        assert layout.row_at(layout.tops[i] + layout.heights[i] / 2) == i
+    assert layout.row_at(0) == 0
+    assert layout.row_at(layout.height + 100) == len(layout) - 1
+
+
+def test_ipv6_summary_uses_a_log_scale_with_exact_addresses():
+    plan = plan_with("2001:db8::/32", ("a", "2001:db8::/64"), ("b", "2001:db8:8000::/33"))
+    layout = Layout(plan, 800)
+    assert layout.scale == "log"
+    assert Layout(plan_with("10.0.0.0/8"), 800).scale == "linear"
+
+    heights = dict(zip((segment[1].label for segment in layout.segments if segment[0] == 'subnet'),
+                       (height for segment, height in zip(layout.segments, layout.heights) if segment[0] == 'subnet')))
+    assert heights["b"] > heights["a"] >= MIN_SUBNET_HEIGHT
+    for i, segment in enumerate(layout.segments):
+        if segment[0] == 'subnet':
+            assert layout.address_at(layout.tops[i]) == segment[1].start
+
+
+def test_rescale_matches_a_fresh_layout():
+    plan = random_plan(4)
+    layout = Layout(plan, 800, "linear")
+    layout.rescale(1500)
+    fresh = Layout(plan, 1500, "linear")
+    assert list(layout.tops) == list(fresh.tops)
+    assert list(layout.heights) == list(fresh.heights)
+    assert layout.height == fresh.height
+
+
+def test_layout_records_the_plan_version_it_was_built_for():
+    plan = random_plan(5, 10)
+    layout = Layout(plan, 800)
+    assert (layout.plan, layout.version) == (plan, plan.version)
+    plan.allocate("new", 24)
+    assert layout.version != plan.version
+
+
+def test_address_and_y_map_back_and_forth():
+    layout = Layout(random_plan(6), 800, "linear")
+    for i, segment in enumerate(layout.segments):
+        first = segment[1] if segment[0] == 'gap' else segment[1].start
+        assert layout.address_at(layout.tops[i]) == first
+        assert layout.y_for_address(first) == layout.tops[i]
+        assert layout.row_at(layout.y_for_address(first)) == i
+
+
+def test_prefixlen_for_height_inverts_row_heights():
+    plan = plan_with("10.0.0.0/16", ("a", "10.0.0.0/18"), ("b", "10.0.64.0/20"))
+    layout = Layout(plan, 1000, "linear")
+    for i, segment in enumerate(layout.segments):
+        if segment[0] == 'subnet':
+            assert layout.prefixlen_for_height(layout.heights[i]) == segment[1].prefixlen
+    assert layout.prefixlen_for_height(layout.available * 10) == 16
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+import cli
+from conftest import plan_with, rows
+from plan_diff import diff_plans, merge_diff
+from subnet_engine import Change, parse_network
+
+
+def kinds(diff):
+    return [(entry.kind,
+             entry.current.label if entry.current is not None else None,
+             entry.other.label if entry.other is not None else None)
+            for entry in diff]
+
+
+def test_diff_classifies_every_kind():
+    current = plan_with("10.0.0.0/16", ("same", "10.0.0.0/24"), ("renamed", "10.0.1.0/24"),
+                        ("grown", "10.0.2.0/24"), ("gone", "10.0.4.0/24"), ("clash", "10.0.6.0/24"))
+    other = plan_with("10.0.0.0/16", ("same", "10.0.0.0/24"), ("new name", "10.0.1.0/24"),
+                      ("grown", "10.0.2.0/23"), ("clash", "10.0.6.128/25"), ("new", "10.0.9.0/24"))
+
+    diff = diff_plans(current, other)
+    assert kinds(diff) == [("relabelled", "renamed", "new name"), ("resized", "grown", "grown"),
+                           ("removed", "gone", None), ("conflicting", "clash", "clash"), ("added", None, "new")]
+    assert diff.counts() == {"added": 1, "removed": 1, "resized": 1, "relabelled": 1, "conflicting": 1}
+    assert [entry.kind for entry in diff.within(int(parse_network("10.0.3.0/24").network_address),
+                                                int(parse_network("10.0.4.255/32").network_address))] == \
+        ["resized", "removed"]
+    assert len(diff_plans(current, current)) == 0
+
+
+def random_plan(rng, count):
+    plan = plan_with("10.0.0.0/20")
+    for i in range(count):
+        try:
+            plan.allocate(f"s{rng.randrange(count)}", rng.randint(24, 28), rng.choice(["first", "best"]))
+        except ValueError:
+            pass
+    return plan
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merge_preferring_the_other_side_reproduces_it(seed):
+    rng = random.Random(seed)
+    current = random_plan(rng, 60)
+    other = random_plan(rng, 60)
+    before = rows(current)
+
+    change, skipped = merge_diff(current, diff_plans(current, other), prefer="other")
+    assert skipped == []
+    assert rows(current) == rows(other)
+    assert len(diff_plans(current, other)) == 0
+
+    current.undo()
+    assert rows(current) == before
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merge_keeping_conflicts_leaves_only_conflicts(seed):
+    rng = random.Random(seed)
+    current = random_plan(rng, 60)
+    other = random_plan(rng, 60)
+    diff = diff_plans(current, other)
+    tangled = {id(subnet) for entry in diff if entry.kind == "conflicting" for subnet in (entry.current, entry.other)}
+
+    change, skipped = merge_diff(current, diff)
+    assert all(id(entry.current) in tangled or id(entry.other) in tangled for entry in skipped)
+    # What is still different involves a subnet that was left out, and
+    # every other subnet of the other side is now in the current plan
+    kept = {id(subnet) for entry in skipped for subnet in (entry.current, entry.other)}
+    for entry in diff_plans(current, other):
+        assert id(entry.current) in kept or id(entry.other) in kept
+    merged = {subnet.state() for subnet in other.subnets if id(subnet) not in kept}
+    assert merged <= {subnet.state() for subnet in current.subnets}
+
+
+def test_stale_diff_is_refused():
+    current = plan_with("10.0.0.0/16", ("a", "10.0.0.0/24"))
+    other = plan_with("10.0.0.0/16", ("b", "10.0.1.0/24"))
+    diff = diff_plans(current, other)
+    current.apply(Change("Remove", [(subnet, subnet.state(), None) for subnet in current.subnets]))
+    with pytest.raises(ValueError, match="Compare again"):
+        merge_diff(current, diff)
+
+
+def test_cli_diff_and_merge(tmp_path, capsys):
+    current = tmp_path / "current.csv"
+    current.write_text("Summary,10.0.0.0/24\na,10.0.0.0/26\nold,10.0.0.64/26\n")
+    other = tmp_path / "other.csv"
+    other.write_text("Summary,10.0.0.0/24\na,10.0.0.0/26\nnew,10.0.0.128/26\n")
+
+    assert cli.main(["diff", str(current), str(other)]) == 1
+    captured = capsys.readouterr()
+    assert "1 added, 1 removed" in captured.err
+    assert "removed,old,10.0.0.64/26,," in captured.out and "added,,,new,10.0.0.128/26" in captured.out
+    assert cli.main(["diff", str(current), str(current)]) == 0
+
+    merged = str(tmp_path / "merged.csv")
+    assert cli.main(["merge", str(current), str(other), "-o", merged]) == 0
+    assert cli.main(["diff", merged, str(other)]) == 0
@@ -0,0 +1,61 @@
+import ipaddress
+import random
+
+from prefix_trie import PrefixTrie
+
+
+def key(text):
+    network = ipaddress.ip_network(text)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def test_nesting_queries():
+    trie = PrefixTrie()
+    for text in ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.2.0.0/16", "2001:db8::/32"]:
+        trie.insert(*key(text), text)
+
+    assert len(trie) == 5
+    assert list(trie) == ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.2.0.0/16", "2001:db8::/32"]
+    assert trie.get(*key("10.1.0.0/16")) == "10.1.0.0/16"
+    assert trie.get(*key("10.1.0.0/17")) is None
+    assert trie.longest_match(*key("10.1.2.128/25")) == "10.1.2.0/24"
+    assert trie.longest_match(*key("10.1.2.0/24"), strict=True) == "10.1.0.0/16"
+    assert trie.longest_match(*key("192.168.0.0/16")) is None
+    assert trie.ancestors(*key("10.1.2.0/24")) == ["10.0.0.0/8", "10.1.0.0/16"]
+    assert trie.children(*key("10.0.0.0/8")) == ["10.1.0.0/16", "10.2.0.0/16"]
+    assert list(trie.subtree(*key("10.1.0.0/16"))) == ["10.1.0.0/16", "10.1.2.0/24"]
+    # A block that is not stored still finds what lies inside it
+    assert list(trie.subtree(*key("10.0.0.0/14"))) == ["10.1.0.0/16", "10.1.2.0/24", "10.2.0.0/16"]
+
+    trie.remove(*key("10.1.0.0/16"))
+    assert trie.children(*key("10.0.0.0/8")) == ["10.1.2.0/24", "10.2.0.0/16"]
+    assert trie.longest_match(*key("10.1.2.0/24"), strict=True) == "10.0.0.0/8"
+
+
+def test_random_blocks_match_a_scan():
+    rng = random.Random(7)
+    trie = PrefixTrie()
+    stored = {}
+    for _ in range(300):
+        prefixlen = rng.randint(4, 20)
+        start = rng.getrandbits(32) >> (32 - prefixlen) << (32 - prefixlen)
+        block = (4, start, prefixlen)
+        if block in stored and rng.random() < 0.5:
+            trie.remove(*block)
+            del stored[block]
+        else:
+            trie.insert(*block, block)
+            stored[block] = block
+    assert len(trie) == len(stored)
+
+    def inside(outer, inner):
+        host_bits = 32 - outer[2]
+        return outer[2] <= inner[2] and outer[1] >> host_bits == inner[1] >> host_bits
+
+    for _ in range(200):
+        prefixlen = rng.randint(0, 24)
+        probe = (4, rng.getrandbits(32) >> (32 - prefixlen) << (32 - prefixlen), prefixlen)
+        containing = sorted((block for block in stored if inside(block, probe)), key=lambda block: block[2])
+        assert trie.longest_match(*probe) == (containing[-1] if containing else None)
+        assert trie.ancestors(*probe) == [block for block in containing if block[2] < prefixlen]
+        assert sorted(trie.subtree(*probe)) == sorted(block for block in stored if inside(probe, block))
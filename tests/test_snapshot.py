@@ -0,0 +1,97 @@
+import pytest
+
+import cli
+from snapshot import HEADER, PLAN_ENTRY, SNAPSHOT_MAGIC, is_snapshot, load_snapshot, open_snapshot, save_snapshot
+from subnet_engine import Subnet, SubnetPlan, parse_network
+
+
+def sample_plans():
+    ipv4 = SubnetPlan(parse_network("10.0.0.0/8"))
+    ipv4.load([Subnet(f"site {i % 5}", 4, (10 << 24) + i * 256, 24) for i in range(300)])
+    ipv6 = SubnetPlan(parse_network("2001:db8::/32"))
+    base = int(parse_network("2001:db8::/32").network_address)
+    ipv6.load([Subnet(f"vlan é{i}", 6, base + (i << 80), 48) for i in range(50)])
+    return [ipv4, ipv6, SubnetPlan(parse_network("192.168.0.0/16"))]
+
+
+def states(plan):
+    return [subnet.state() for subnet in plan.subnets]
+
+
+def test_round_trip(tmp_path):
+    plans = sample_plans()
+    path = tmp_path / "plan.snap"
+    save_snapshot(plans, path)
+    assert is_snapshot(path)
+
+    loaded = load_snapshot(path)
+    assert [plan.summary for plan in loaded] == [plan.summary for plan in plans]
+    assert [states(plan) for plan in loaded] == [states(plan) for plan in plans]
+    # A loaded plan is a full plan, with overlap checks and free space
+    with pytest.raises(ValueError):
+        loaded[0].add_subnet("clash", parse_network("10.0.1.128/25"))
+    assert loaded[0].allocate("new", 24).network == parse_network("10.1.44.0/24")
+
+
+def test_mapped_rows_are_read_lazily(tmp_path):
+    plans = sample_plans()
+    path = tmp_path / "plan.snap"
+    save_snapshot(plans, path)
+
+    with open_snapshot(path) as snapshot:
+        assert len(snapshot) == 350
+        ipv4, ipv6, empty = snapshot.plans
+        assert ipv4.subnets[-1].state() == plans[0].subnets[-1].state()
+        assert ipv4.find(int(parse_network("10.0.5.77/32").network_address)).label == "site 0"
+        assert ipv4.find(int(parse_network("10.200.0.0/32").network_address)) is None
+        assert ipv6.find(plans[1].subnets[7].start + 1).label == "vlan é7"
+        assert len(empty) == 0
+
+
+def test_truncated_and_foreign_files_are_refused(tmp_path):
+    path = tmp_path / "plan.snap"
+    save_snapshot(sample_plans(), path)
+    data = path.read_bytes()
+
+    truncated = tmp_path / "truncated.snap"
+    truncated.write_bytes(data[:len(data) // 2])
+    with pytest.raises(ValueError, match="truncated"):
+        open_snapshot(truncated)
+
+    foreign = tmp_path / "plan.csv"
+    foreign.write_text("Label,Subnet\n")
+    assert not is_snapshot(foreign)
+    with pytest.raises(ValueError):
+        open_snapshot(foreign)
+
+    assert data.startswith(SNAPSHOT_MAGIC)
+
+
+@pytest.mark.parametrize("column, value, message", [(9, 5, "label id 5"), (8, 40, "prefix length 40")])
+def test_corrupted_columns_are_refused(tmp_path, capsys, column, value, message):
+    path = tmp_path / "plan.snap"
+    save_snapshot(sample_plans(), path)
+    data = bytearray(path.read_bytes())
+    # Overwrite the first row of the IPv4 plan's label_id or prefixlen column
+    offset = PLAN_ENTRY.unpack_from(data, HEADER.size)[column]
+    data[offset] = value
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match=message):
+        open_snapshot(path)
+    assert cli.main(["validate", str(path)]) == 1
+    assert cli.main(["export", str(path)]) == 1
+    assert "corrupted" in capsys.readouterr().err
+
+
+def test_cli_converts_to_a_snapshot_and_back(tmp_path, capsys):
+    path = tmp_path / "plan.csv"
+    path.write_text("Summary,10.0.0.0/24\nLabel,Subnet\na,10.0.0.0/26\nb,10.0.0.128/25\n")
+    snap = str(tmp_path / "plan.snap")
+    assert cli.main(["export", str(path), "-o", snap]) == 0
+    assert is_snapshot(snap)
+
+    assert cli.main(["export", snap]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "Summary,10.0.0.0/24"
+    assert [line.split(",")[:2] for line in out[2:]] == [["a", "10.0.0.0/26"], ["b", "10.0.0.128/25"]]
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from tasks import Task
+
+
+def wait(task, timeout=5):
+    # Messages of a finished task, polled the way the UI polls it
+    messages = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        messages.extend(task.poll())
+        if messages and messages[-1][0] != 'progress':
+            return messages
+        time.sleep(0.01)
+    raise AssertionError("task did not finish")
+
+
+def test_progress_then_result():
+    def work(progress, count):
+        for i in range(count):
+            progress(i)
+        return count * 2
+
+    assert wait(Task(work, 3).start()) == [('progress', 0), ('progress', 1), ('progress', 2), ('done', 6)]
+
+
+def test_errors_are_reported_not_raised():
+    def work(progress):
+        raise ValueError("bad row")
+
+    kind, payload = wait(Task(work).start())[-1]
+    assert kind == 'error' and str(payload) == "bad row"
+
+
+def test_cancel_stops_at_the_next_progress_call():
+    started = threading.Event()
+    resume = threading.Event()
+    reached = []
+
+    def work(progress):
+        started.set()
+        resume.wait(5)
+        progress(1)
+        reached.append(True)
+
+    task = Task(work).start()
+    started.wait(5)
+    task.cancel()
+    resume.set()
+    assert wait(task) == [('cancelled', None)]
+    assert task.cancelled and not reached
+
+
+def test_cancel_after_the_last_checkpoint_still_wins():
+    resume = threading.Event()
+
+    def work(progress):
+        resume.wait(5)
+        return "result"
+
+    task = Task(work).start()
+    task.cancel()
+    resume.set()
+    assert wait(task) == [('cancelled', None)]
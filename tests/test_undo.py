@@ -0,0 +1,44 @@
+from conftest import plan_with, rows
+from subnet_engine import HISTORY_LIMIT, parse_network
+
+
+def test_undo_and_redo_restore_the_plan():
+    plan = plan_with("10.0.0.0/24", ("a", "10.0.0.0/26"))
+    subnet = plan.subnets[0]
+    plan.update_subnet(subnet, "renamed", parse_network("10.0.0.64/26"))
+    plan.add_subnet("b", parse_network("10.0.0.0/26"))
+    after = rows(plan)
+
+    plan.undo()
+    plan.undo()
+    assert rows(plan) == [("a", "10.0.0.0/26")]
+    plan.undo()
+    assert plan.undo() is None
+    assert rows(plan) == []
+    while plan.redo() is not None:
+        pass
+    assert rows(plan) == after
+
+
+def test_listeners_see_only_the_touched_subnets():
+    plan = plan_with("10.0.0.0/24", ("a", "10.0.0.0/26"), ("b", "10.0.0.64/26"))
+    changes = []
+    plan.listeners.append(changes.append)
+    version = plan.version
+
+    moved = plan.subnets[1]
+    plan.relocate_subnet(moved, parse_network("10.0.0.128/26"))
+    plan.undo()
+    assert [change.subnets() for change in changes] == [[moved], [moved]]
+    assert plan.version == version + 2
+
+
+def test_new_change_clears_redo_and_history_is_bounded():
+    plan = plan_with("10.0.0.0/16")
+    for i in range(HISTORY_LIMIT + 5):
+        plan.allocate(f"s{i}", 28)
+    assert len(plan.undo_stack) == HISTORY_LIMIT
+
+    plan.undo()
+    plan.allocate("new", 28)
+    assert plan.redo() is None